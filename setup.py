@@ -41,10 +41,15 @@ setup(
 
     install_requires=[
       'coloredlogs',
+      'numpy',
       'pyspiel',
       'chess',
       # This is true, but doesn't work realiably
       'gi',
       'gi-cairo'
     ],
+    extras_require={
+      # Lay out graphs without running graphviz as a new process.
+      'layout': ['pygraphviz'],
+    },
 )
@@ -53,7 +53,21 @@ user_cfg = load_config("~/.spielviz_cfg.py")
 # ======================= Define all configurations. ===========================
 
 DEFAULT_GAME = user_cfg.DEFAULT_GAME or "kuhn_poker"
+# How to lay out the game tree:
+# dot  - with graphviz, see GRAPHVIZ_FILTER
+# tidy - built-in tidy tree layout, which scales to large trees
 LAYOUT = user_cfg.LAYOUT or "dot"
+# Lay out trees with at least LAYOUT_SPLIT_MIN_NODES nodes with graphviz in
+# parts: the subtrees at LAYOUT_SPLIT_DEPTH are laid out in parallel in
+# TREE_WORKERS processes, and put side by side. Dot takes superlinear time,
+# so this is faster even with a single worker. The tidy layout is fast enough
+# for the whole tree.
+LAYOUT_SPLIT_MIN_NODES = user_cfg.LAYOUT_SPLIT_MIN_NODES or 2000
+LAYOUT_SPLIT_DEPTH = user_cfg.LAYOUT_SPLIT_DEPTH or 2
+# Reuse the previous tidy layout for the parts of the tree that did not change.
+LAYOUT_INCREMENTAL = user_cfg.LAYOUT_INCREMENTAL
+if LAYOUT_INCREMENTAL is None:
+  LAYOUT_INCREMENTAL = True
 LOGGING_LEVEL = user_cfg.LOGGING_LEVEL or logging.INFO
 
 # [Window]
@@ -71,13 +85,68 @@ WINDOW_MAXIMIZE = user_cfg.WINDOW_MAXIMIZE or False
 # patchwork - squarified tree maps
 # osage     - array-based layouts
 GRAPHVIZ_FILTER = user_cfg.GRAPHVIZ_FILTER or "dot"
+# Lay out graphs with the graphviz library (through pygraphviz, if it is
+# installed), instead of running the filter as a new process for each update.
+# The process is still used if the library fails.
+GRAPHVIZ_IN_PROCESS = user_cfg.GRAPHVIZ_IN_PROCESS
+if GRAPHVIZ_IN_PROCESS is None:
+  GRAPHVIZ_IN_PROCESS = True
+# Stop graphviz if it takes longer than this many seconds to lay out the tree,
+# and show the tree with the (much faster) tidy tree layout instead.
+# Use 0 for no limit. The library can't be stopped, so with a limit it lays
+# out only graphs of up to GRAPHVIZ_IN_PROCESS_MAX_BYTES of DOT code, which
+# take little time anyway; the larger ones are laid out by the filter process.
+LAYOUT_TIMEOUT = user_cfg.LAYOUT_TIMEOUT
+if LAYOUT_TIMEOUT is None:
+  LAYOUT_TIMEOUT = 10
+GRAPHVIZ_IN_PROCESS_MAX_BYTES = user_cfg.GRAPHVIZ_IN_PROCESS_MAX_BYTES \
+                                or 64 * 1024
+# Layouts are cached by their DOT input: the recent ones in memory,
+# the rest in a size-bounded directory. Use 0 as the size to keep them only
+# in memory.
+LAYOUT_CACHE_DIR = user_cfg.LAYOUT_CACHE_DIR \
+                   or os.path.expanduser("~/.cache/spielviz/layouts")
+LAYOUT_CACHE_MAX_BYTES = user_cfg.LAYOUT_CACHE_MAX_BYTES
+if LAYOUT_CACHE_MAX_BYTES is None:
+  LAYOUT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+LAYOUT_CACHE_MEMORY_ENTRIES = user_cfg.LAYOUT_CACHE_MEMORY_ENTRIES
+if LAYOUT_CACHE_MEMORY_ENTRIES is None:
+  LAYOUT_CACHE_MEMORY_ENTRIES = 16
+# Graphviz settings by the size of the graph. The last tier whose min_nodes
+# the graph reaches is used:
+# graph_attrs - attributes of the graph, see `man dot`
+# edge_label  - attribute that holds the action labels of the edges. With
+#               "label", dot makes room for the labels in the layout, which
+#               takes most of its time on large trees. With "headlabel",
+#               they are just placed next to the edges, several times faster.
+GRAPHVIZ_TIERS = user_cfg.GRAPHVIZ_TIERS or [
+  dict(min_nodes=0, graph_attrs=dict(), edge_label="label"),
+  dict(min_nodes=1000, graph_attrs=dict(splines="line"),
+       edge_label="headlabel"),
+  dict(min_nodes=5000,
+       graph_attrs=dict(splines="line", nslimit=1, mclimit=0.5,
+                        remincross="false"),
+       edge_label="headlabel"),
+]
 PLOT_FONTSIZE = user_cfg.PLOT_FONTSIZE or 8
 PLOT_WIDTH = user_cfg.PLOT_WIDTH or 0.25
 PLOT_HEIGHT = user_cfg.PLOT_HEIGHT or 0.25
 PLOT_ARROWSIZE = user_cfg.PLOT_ARROWSIZE or .25
 PLOT_MARGIN = user_cfg.PLOT_MARGIN or 0.01
 PLOT_HIGHLIGHT_PENWIDTH = user_cfg.PLOT_HIGHLIGHT_PENWIDTH or 4
+# Skip the nodes and edges that are smaller than this many pixels on the
+# screen, unless they are highlighted. Their shapes are not even parsed, so
+# large graphs zoomed out are drawn much faster. Use 0 to draw all of them.
+PLOT_MIN_SIZE = user_cfg.PLOT_MIN_SIZE
+if PLOT_MIN_SIZE is None:
+  PLOT_MIN_SIZE = 1
 HIGHLIGHT_COLOR = user_cfg.HIGHLIGHT_COLOR or (.8, .8, .1, 1)
+# Style of nodes whose children were not shown because of TREE_MAX_NODES.
+PLOT_TRUNCATED_STYLE = user_cfg.PLOT_TRUNCATED_STYLE or "dashed"
+# Style of nodes that stand for collapsed children, see TREE_TOP_K.
+PLOT_COLLAPSED_STYLE = user_cfg.PLOT_COLLAPSED_STYLE or "dotted"
+# Style of the connectors between nodes of the same information set.
+PLOT_INFOSET_STYLE = user_cfg.PLOT_INFOSET_STYLE or "dashed"
 
 # [Players]
 PLAYER_COLORS = user_cfg.PLAYER_COLORS or {
@@ -112,6 +181,48 @@ PLAYER_SHAPES = user_cfg.PLAYER_COLORS or {
 
 # [Show options]
 TREE_MAX_NODES = user_cfg.TREE_MAX_NODES or 1000
+# How to spend the TREE_MAX_NODES budget if the tree does not fit into it:
+# breadth_first - fill the tree level by level (balanced tree)
+# depth_first   - expand branches one after another
+TREE_EXPANSION = user_cfg.TREE_EXPANSION or "breadth_first"
+# Merge transpositions, i.e. draw the tree as a DAG where each position
+# (identified by the state string) has one node. Use only for games whose
+# state string describes the state completely, like perfect-information
+# board games.
+TREE_TRANSPOSITIONS = user_cfg.TREE_TRANSPOSITIONS or False
+# Show at most this many children of each node (the most probable chance
+# outcomes, or the first actions), and collapse the rest into a single node
+# that can be clicked to expand them. Use 0 to show all the children.
+TREE_TOP_K = user_cfg.TREE_TOP_K or 0
+# The same for simultaneous nodes, whose number of joint actions grows
+# exponentially with the number of players. The joint actions are generated
+# lazily, so the collapsed ones are never enumerated.
+TREE_MAX_JOINT_ACTIONS = user_cfg.TREE_MAX_JOINT_ACTIONS or 64
+# Connect the nodes of the same information set.
+TREE_INFOSETS = user_cfg.TREE_INFOSETS or False
+# Expand the full tree in this many worker processes, if it may have at least
+# TREE_PARALLEL_MIN_NODES nodes. The tree is split into subtrees for
+# the workers at TREE_SPLIT_DEPTH.
+# A node takes about 15 us to expand, while the workers cost about 0.15 s per
+# build to send the subtrees back, plus about 0.7 s to start on the first
+# build. Below some 50,000 nodes a single process is faster, so the workers
+# are only used when TREE_MAX_NODES is raised well above its default, which
+# keeps the drawing responsive.
+TREE_WORKERS = user_cfg.TREE_WORKERS or os.cpu_count() or 1
+TREE_PARALLEL_MIN_NODES = user_cfg.TREE_PARALLEL_MIN_NODES or 50000
+TREE_SPLIT_DEPTH = user_cfg.TREE_SPLIT_DEPTH or 2
+# How many expanded nodes to remember between redraws of the tree.
+# Use 0 to disable the cache.
+TREE_CACHE_SIZE = user_cfg.TREE_CACHE_SIZE
+if TREE_CACHE_SIZE is None:
+  TREE_CACHE_SIZE = 20000
+# Number of random probes used to estimate the size of the tree before
+# building it.
+TREE_ESTIMATE_PROBES = user_cfg.TREE_ESTIMATE_PROBES or 200
+# How many snapshots of replayed states to keep for seeking to histories.
+HISTORY_CACHE_SIZE = user_cfg.HISTORY_CACHE_SIZE
+if HISTORY_CACHE_SIZE is None:
+  HISTORY_CACHE_SIZE = 256
 LOOKAHEAD = user_cfg.LOOKAHEAD or 1
 LOOKBEHIND = user_cfg.LOOKAHEAD or 3
 FULL_TREE = user_cfg.FULL_TREE or False
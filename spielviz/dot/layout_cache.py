@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, Optional
+
+# Filter -> graphviz version string, as printed by `filter -V`.
+_versions: Dict[str, str] = dict()
+# Seconds to wait for the version.
+VERSION_TIMEOUT = 5
+
+
+def graphviz_version(filter: str) -> str:
+  """Version of graphviz that runs the filter, part of the cache keys."""
+  if filter not in _versions:
+    try:
+      p = subprocess.run([filter, "-V"], stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, check=False,
+                         timeout=VERSION_TIMEOUT)
+      _versions[filter] = p.stdout.decode(errors="replace").strip()
+    except (OSError, subprocess.TimeoutExpired) as e:
+      logging.debug(f"Could not get version of '{filter}': {e}")
+      _versions[filter] = "unknown"
+  return _versions[filter]
+
+
+class LayoutCache:
+  """
+  Content-addressed cache of xdot layouts, keyed by a hash of the DOT input,
+  the filter and the graphviz version.
+
+  Recently used layouts are kept in memory, in front of a directory of
+  layout files. The directory is bounded in size, and the least recently
+  used files (by modification time, which is bumped on every hit) are
+  evicted first.
+  """
+
+  SUFFIX = ".xdot"
+
+  def __init__(self, directory: Optional[str], max_bytes: int,
+      memory_entries: int):
+    """
+    :param directory: Where to store the layouts, None to keep them only
+                      in memory.
+    """
+    assert max_bytes >= 0
+    assert memory_entries >= 0
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.memory_entries = memory_entries
+    self.memory: Dict[str, bytes] = collections.OrderedDict()
+    # Total size of the layout files, computed on first use.
+    self.disk_bytes: Optional[int] = None
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def key(dotcode: bytes, filter: str, version: Optional[str] = None) -> str:
+    """
+    :param version: Version of graphviz that lays out the graph, by default
+                    the one that runs the filter.
+    """
+    digest = hashlib.sha256()
+    digest.update(filter.encode())
+    digest.update(b"\0")
+    digest.update((version or graphviz_version(filter)).encode())
+    digest.update(b"\0")
+    digest.update(dotcode)
+    return digest.hexdigest()
+
+  def get(self, key: str) -> Optional[bytes]:
+    with self.lock:
+      xdotcode = self.memory.get(key)
+      if xdotcode is not None:
+        self.memory.move_to_end(key)
+        return xdotcode
+
+      path = self._path(key)
+      if path is None:
+        return None
+      try:
+        with open(path, "rb") as f:
+          xdotcode = f.read()
+        os.utime(path)
+      except OSError:
+        return None
+      self._remember(key, xdotcode)
+      return xdotcode
+
+  def put(self, key: str, xdotcode: bytes):
+    with self.lock:
+      self._remember(key, xdotcode)
+      path = self._path(key)
+      if path is None or len(xdotcode) > self.max_bytes:
+        return
+      try:
+        os.makedirs(self.directory, exist_ok=True)
+        self._init_disk_bytes()
+        # Write atomically, so that a crash never leaves a partial layout.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+          f.write(xdotcode)
+        # The same layout may be stored again, e.g. by another window.
+        try:
+          old_bytes = os.path.getsize(path)
+        except OSError:
+          old_bytes = 0
+        os.replace(tmp_path, path)
+        self.disk_bytes += len(xdotcode) - old_bytes
+        self._evict()
+      except OSError as e:
+        logging.warning(f"Could not store layout in '{self.directory}': {e}")
+
+  def _path(self, key: str) -> Optional[str]:
+    if self.directory is None or self.max_bytes == 0:
+      return None
+    return os.path.join(self.directory, key + self.SUFFIX)
+
+  def _remember(self, key: str, xdotcode: bytes):
+    if self.memory_entries == 0:
+      return
+    self.memory[key] = xdotcode
+    self.memory.move_to_end(key)
+    while len(self.memory) > self.memory_entries:
+      self.memory.popitem(last=False)
+
+  def _layout_files(self):
+    with os.scandir(self.directory) as entries:
+      return [entry for entry in entries
+              if entry.is_file() and entry.name.endswith(self.SUFFIX)]
+
+  def _init_disk_bytes(self):
+    if self.disk_bytes is None:
+      self.disk_bytes = sum(entry.stat().st_size
+                            for entry in self._layout_files())
+
+  def _evict(self):
+    if self.disk_bytes <= self.max_bytes:
+      return
+    files = sorted(self._layout_files(),
+                   key=lambda entry: entry.stat().st_mtime)
+    # Recount, the directory may be shared with other instances.
+    self.disk_bytes = sum(entry.stat().st_size for entry in files)
+    for entry in files:
+      if self.disk_bytes <= self.max_bytes:
+        break
+      size = entry.stat().st_size
+      try:
+        os.remove(entry.path)
+      except OSError:
+        continue
+      self.disk_bytes -= size
@@ -1,7 +1,7 @@
 import os
 import re
 import mmap
-from typing import Optional, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from spielviz.dot.scanner import DotScanner
 
@@ -38,11 +38,18 @@ class Lexer:
   # should be overriden by derived classes
   scanner = None
   tabsize = 8
+  # Types of the tokens whose text `filter` changes.
+  filtered_types = frozenset()
 
   newline_re = re.compile(br'\r\n?|\n')
 
   def __init__(self, buf: Optional[bytes] = None, pos: int = 0,
-      filename: None = None, fp: None = None) -> None:
+      filename: None = None, fp: None = None,
+      chunks: Optional[Iterable[bytes]] = None) -> None:
+    """
+    :param chunks: Read the input from these chunks, as they come, instead
+                   of the buffer, see `token_batches`.
+    """
     if fp is not None:
       try:
         fileno = fp.fileno()
@@ -70,6 +77,10 @@ class Lexer:
 
     self.buf = buf
     self.pos = pos
+    self.start = pos
+    self.chunks = chunks
+    # The chunks read so far.
+    self.received: List[bytes] = []
     self.line = 1
     self.col = 1
     self.filename = filename
@@ -98,11 +109,15 @@ class Lexer:
     return Token(type=type, text=text, line=line, col=col)
 
   def consume(self, text: bytes) -> None:
+    self.line, self.col = self.advance(self.line, self.col, text)
+
+  def advance(self, line: int, col: int, text: bytes) -> Tuple[int, int]:
+    """:return: Line and column after the text that starts at line, col."""
     # update line number
     pos = 0
     for mo in self.newline_re.finditer(text, pos):
-      self.line += 1
-      self.col = 1
+      line += 1
+      col = 1
       pos = mo.end()
 
     # update column number
@@ -110,14 +125,120 @@ class Lexer:
       tabpos = text.find(b'\t', pos)
       if tabpos == -1:
         break
-      self.col += tabpos - pos
-      self.col = ((self.col - 1) // self.tabsize + 1) * self.tabsize + 1
+      col += tabpos - pos
+      col = ((col - 1) // self.tabsize + 1) * self.tabsize + 1
       pos = tabpos + 1
-    self.col += len(text) - pos
+    col += len(text) - pos
+    return line, col
+
+  def line_col(self, offset: int) -> Tuple[int, int]:
+    """Line and column of the byte at offset, counted from the start."""
+    if self.chunks is not None:
+      return self.advance(1, 1, b''.join(self.received)[:offset])
+    return self.advance(1, 1, self.buf[self.start:offset])
+
+  def tokenize(self) -> Tuple[List[int], List[bytes], List[int]]:
+    """
+    Split the rest of the buffer into tokens in a single pass.
+
+    Unlike `__next__`, this does not track lines and columns: get them
+    from the offsets with `line_col`, when needed.
+    :return: Types, texts and offsets of the tokens, ending with EOF.
+    """
+    types, texts, offsets = [], [], []
+    self.pos = self.sweep(self.buf, self.pos, 0, True, types, texts, offsets)
+    types.append(EOF)
+    texts.append(b'')
+    offsets.append(self.pos)
+    return types, texts, offsets
+
+  def token_batches(self) \
+      -> Iterator[Tuple[List[int], List[bytes], List[int]]]:
+    """
+    Tokens of the input, in batches like `tokenize`: the whole buffer, or
+    the tokens of each chunk as soon as it is read. The last batch ends
+    with EOF.
+    """
+    if self.chunks is None:
+      yield self.tokenize()
+      return
+
+    # The input after the tokens so far, at the offset base.
+    pending = b''
+    base = 0
+    for chunk in self.chunks:
+      self.received.append(chunk)
+      buf = pending + chunk
+      types, texts, offsets = [], [], []
+      end = self.sweep(buf, 0, base, False, types, texts, offsets)
+      pending = buf[end:]
+      base += end
+      if types:
+        yield types, texts, offsets
+
+    types, texts, offsets = [], [], []
+    end = self.sweep(pending, 0, base, True, types, texts, offsets)
+    types.append(EOF)
+    texts.append(b'')
+    offsets.append(base + end)
+    yield types, texts, offsets
+
+  def sweep(self, buf: bytes, pos: int, base: int, final: bool,
+      types: List[int], texts: List[bytes], offsets: List[int]) -> int:
+    """
+    Append the tokens of buf from pos to types, texts and offsets, with the
+    offsets counted from base.
+
+    :param final: Whether buf is the end of the input. If not, the last
+                  token may continue in the input that follows, so it is
+                  left out, as is the rest from an unexpected char on (which
+                  may start a string or a comment).
+    :return: Position in buf after the tokens.
+    """
+    scanner = self.scanner
+    literals = scanner.literals
+    symbols = scanner.symbols
+    filtered_types = self.filtered_types
+    # Match group -> token type and whether to look it up in the literals.
+    groups = [(None, False)] + [(type, test_lit)
+                                for type, regexp, test_lit in scanner.tokens]
+    other = len(groups)
+
+    mo = None
+    for mo in scanner.sweep_re.finditer(buf, pos):
+      group = mo.lastindex
+      if group == other:
+        text = mo.group()
+        type = symbols.get(text)
+        if type is None:
+          if not final:
+            return mo.start()
+          line, col = self.line_col(base + mo.start())
+          msg = 'unexpected char %r' % (text,)
+          raise ParseError(msg, self.filename, line, col)
+      else:
+        type, test_lit = groups[group]
+        if type == SKIP:
+          continue
+        text = mo.group()
+        if test_lit:
+          type = literals.get(text, type)
+        elif type in filtered_types:
+          type, text = self.filter(type, text)
+      types.append(type)
+      texts.append(text)
+      offsets.append(base + mo.start())
+
+    if not final and mo is not None and mo.end() == len(buf):
+      if offsets and offsets[-1] == base + mo.start():
+        del types[-1], texts[-1], offsets[-1]
+      return mo.start()
+    return len(buf)
 
 
 class DotLexer(Lexer):
   scanner = DotScanner()
+  filtered_types = frozenset((STR_ID, HTML_ID))
 
   def filter(self, type: int, text: bytes) -> Tuple[int, bytes]:
     # TODO: handle charset
@@ -1,10 +1,24 @@
 import colorsys
+import concurrent.futures
+import functools
+import logging
+import re
 import subprocess
 import sys
-from typing import Dict, List, Tuple, Union
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+  import pygraphviz
+except ImportError:
+  pygraphviz = None
 
 import spielviz.config as cfg
-from spielviz.dot.lexer import DotLexer, Token, ParseError
+from spielviz.dot.layout_cache import LayoutCache
+from spielviz.dot.lexer import DotLexer, ParseError
 from spielviz.graphics import elements, shape
 from spielviz.graphics.pen import Pen
 
@@ -33,34 +47,55 @@ NODE = 16
 EDGE = 17
 SUBGRAPH = 18
 
+# Line breaks of labels: escaped, or in the text.
+LABEL_LINES_RE = re.compile(br'\\[nlr]|\n')
+# Height of the lines of labels, relative to the font size.
+LINE_SPACING = 1.2
+# Size of the chunks of the output of graphviz that are parsed as they come.
+OUTPUT_CHUNK_SIZE = 64 * 1024
+# How often to check whether the layout was cancelled, in seconds.
+CANCEL_CHECK_INTERVAL = 0.1
+
 
 class Parser:
   def __init__(self, lexer: DotLexer) -> None:
     self.lexer = lexer
-    self.lookahead = next(self.lexer)
+    self.batches = lexer.token_batches()
+    self.read_tokens()
+
+  def error(self, msg: str) -> ParseError:
+    line, col = self.lexer.line_col(self.offsets[self.index])
+    return ParseError(msg=msg, filename=self.lexer.filename, line=line,
+                      col=col)
 
   def match(self, type: int) -> None:
-    if self.lookahead.type != type:
-      raise ParseError(
-          msg='unexpected token {}'.format(self.lookahead.text),
-          filename=self.lexer.filename,
-          line=self.lookahead.line,
-          col=self.lookahead.col)
+    if self.lookahead_type != type:
+      raise self.error('unexpected token {}'.format(self.lookahead_text))
 
   def skip(self, type: int) -> None:
-    while self.lookahead.type != type:
-      if self.lookahead.type == EOF:
-        raise ParseError(
-            msg='unexpected end of file',
-            filename=self.lexer.filename,
-            line=self.lookahead.line,
-            col=self.lookahead.col)
+    while self.lookahead_type != type:
+      if self.lookahead_type == EOF:
+        raise self.error('unexpected end of file')
       self.consume()
 
-  def consume(self) -> Token:
-    token = self.lookahead
-    self.lookahead = next(self.lexer)
-    return token
+  def consume(self) -> bytes:
+    text = self.lookahead_text
+    # Stay at the EOF token at the end.
+    if self.lookahead_type != EOF:
+      self.index += 1
+      if self.index == len(self.types):
+        self.read_tokens()
+      else:
+        self.lookahead_type = self.types[self.index]
+        self.lookahead_text = self.texts[self.index]
+    return text
+
+  def read_tokens(self) -> None:
+    """Continue with the next batch of tokens from the lexer."""
+    self.types, self.texts, self.offsets = next(self.batches)
+    self.index = 0
+    self.lookahead_type = self.types[0]
+    self.lookahead_text = self.texts[0]
 
 
 class XDotAttrParser:
@@ -72,58 +107,106 @@ class XDotAttrParser:
   def __init__(self, parser, buf: bytes) -> None:
     self.parser = parser
     self.buf = buf
-    self.pos = 0
 
     self.pen = Pen()
     self.shapes = []
 
-  def __bool__(self) -> bool:
-    return self.pos < len(self.buf)
-
-  def read_code(self) -> str:
-    pos = self.buf.find(b" ", self.pos)
-    res = self.buf[self.pos:pos]
-    self.pos = pos + 1
-    self.skip_space()
-    res = res.decode('utf-8')
-    return res
-
-  def skip_space(self) -> None:
-    while self.pos < len(self.buf) and self.buf[
-                                       self.pos:self.pos + 1].isspace():
-      self.pos += 1
-
-  def read_int(self) -> int:
-    return int(self.read_code())
-
-  def read_float(self) -> float:
-    return float(self.read_code())
-
-  def read_point(self) -> Tuple[float, float]:
-    x = self.read_float()
-    y = self.read_float()
-    return self.transform(x, y)
-
-  def read_text(self) -> str:
-    num = self.read_int()
-    pos = self.buf.find(b"-", self.pos) + 1
-    self.pos = pos + num
-    res = self.buf[pos:self.pos]
-    self.skip_space()
-    res = res.decode('utf-8')
-    return res
-
-  def read_polygon(self) -> List[Tuple[float, float]]:
-    n = self.read_int()
-    p = []
-    for i in range(n):
-      x, y = self.read_point()
-      p.append((x, y))
-    return p
-
-  def read_color(self) -> Tuple[float, float, float, float]:
+  @staticmethod
+  def parse_all(parser, bufs: List[bytes]) -> List[List[shape.Shape]]:
+    """
+    Parse many drawing attributes at once: the coordinates of all their
+    points are converted and transformed together, as arrays.
+    :return: Shapes of each attribute.
+    """
+    attr_parsers = [XDotAttrParser(parser, buf) for buf in bufs]
+    coords = []
+    ops = [attr_parser.read_ops(coords) for attr_parser in attr_parsers]
+    points = parser.transform_points(coords)
+    return [attr_parser.run_ops(attr_ops, points)
+            for attr_parser, attr_ops in zip(attr_parsers, ops)]
+
+  def parse(self) -> List[shape.Shape]:
+    return XDotAttrParser.parse_all(self.parser, [self.buf])[0]
+
+  def read_ops(self, coords: List[bytes]) -> List[Tuple[str, tuple]]:
+    """
+    Split the attribute into its operations.
+
+    The coordinates of the points are not converted here, but appended to
+    coords. The operations refer to the points by their index in coords.
+    :return: Codes and arguments of the operations.
+    """
+    # The fields are separated by single spaces, see `read_text` for texts
+    # with spaces.
+    words = self.buf.split(b" ")
+    num_words = len(words)
+    num_points = len(coords) // 2
+    ops = []
+    i = 0
+    while i < num_words:
+      op = words[i].decode("utf-8")
+      i += 1
+      if op == "c" or op == "C" or op == "S":
+        text, i = self.read_text(words, i)
+        ops.append((op, text))
+      elif op == "F":
+        size = float(words[i])
+        name, i = self.read_text(words, i + 1)
+        ops.append((op, (size, name)))
+      elif op == "T":
+        coords.extend(words[i:i + 2])
+        j = int(words[i + 2])
+        w = float(words[i + 3])
+        t, i = self.read_text(words, i + 4)
+        ops.append((op, (num_points, j, w, t)))
+        num_points += 1
+      elif op == "t":
+        ops.append((op, int(words[i])))
+        i += 1
+      elif op == "E" or op == "e":
+        coords.extend(words[i:i + 2])
+        ops.append((op, (num_points, float(words[i + 2]),
+                         float(words[i + 3]))))
+        num_points += 1
+        i += 4
+      elif op in ("L", "B", "b", "P", "p"):
+        n = int(words[i])
+        coords.extend(words[i + 1:i + 1 + 2 * n])
+        ops.append((op, (num_points, n)))
+        num_points += n
+        i += 1 + 2 * n
+      elif op == "I":
+        coords.extend(words[i:i + 2])
+        w = float(words[i + 2])
+        h = float(words[i + 3])
+        path, i = self.read_text(words, i + 4)
+        ops.append((op, (num_points, w, h, path)))
+        num_points += 1
+      elif op:
+        sys.stderr.write("error: unknown xdot opcode '%s'\n" % op)
+        sys.exit(1)
+    return ops
+
+  @staticmethod
+  def read_text(words: List[bytes], i: int) -> Tuple[str, int]:
+    """
+    Read a text field, "num -text" with the text num bytes long, which
+    starts at words[i].
+    :return: The text, and the index of the word after it.
+    """
+    num = int(words[i])
+    text = words[i + 1][1:]
+    i += 2
+    # The text was split at its spaces.
+    while len(text) < num:
+      text += b" " + words[i]
+      i += 1
+    return text.decode("utf-8"), i
+
+  @staticmethod
+  @functools.lru_cache(maxsize=1024)
+  def parse_color(c: str) -> Optional[Tuple[float, float, float, float]]:
     # See http://www.graphviz.org/doc/info/attrs.html#k:color
-    c = self.read_text()
     c1 = c[:1]
     if c1 == '#':
       hex2float = lambda h: float(int(h, 16) / 255.0)
@@ -148,25 +231,24 @@ class XDotAttrParser:
       sys.stderr.write('warning: unknown color\n')
       return 0., 0., 0., 0.
 
-  def parse(self) -> Union[List[shape.PolygonShape],
-                           List[shape.TextShape],
-                           List[shape.BezierShape],
-                           List[shape.EllipseShape]]:
-    s = self
-
-    while s:
-      op = s.read_code()
+  def run_ops(self, ops: List[Tuple[str, tuple]],
+      points: List[Tuple[float, float]]) -> List[shape.Shape]:
+    """
+    Draw the operations from `read_ops`.
+    :param points: The transformed points of the coords of `read_ops`.
+    """
+    for op, args in ops:
       if op == "c":
-        color = s.read_color()
+        color = self.parse_color(args)
         if color is not None:
           self.handle_color(color, filled=False)
       elif op == "C":
-        color = s.read_color()
+        color = self.parse_color(args)
         if color is not None:
           self.handle_color(color, filled=True)
       elif op == "S":
         # http://www.graphviz.org/doc/info/attrs.html#k:style
-        style = s.read_text()
+        style = args
         if style.startswith("setlinewidth("):
           lw = style.split("(")[1].split(")")[0]
           lw = float(lw)
@@ -174,58 +256,34 @@ class XDotAttrParser:
         elif style in ("solid", "dashed", "dotted"):
           self.handle_linestyle(style)
       elif op == "F":
-        size = s.read_float()
-        name = s.read_text()
+        size, name = args
         self.handle_font(size, name)
       elif op == "T":
-        x, y = s.read_point()
-        j = s.read_int()
-        w = s.read_float()
-        t = s.read_text()
+        point, j, w, t = args
+        x, y = points[point]
         self.handle_text(x, y, j, w, t)
       elif op == "t":
-        f = s.read_int()
-        self.handle_font_characteristics(f)
-      elif op == "E":
-        x0, y0 = s.read_point()
-        w = s.read_float()
-        h = s.read_float()
-        self.handle_ellipse(x0, y0, w, h, filled=True)
-      elif op == "e":
-        x0, y0 = s.read_point()
-        w = s.read_float()
-        h = s.read_float()
-        self.handle_ellipse(x0, y0, w, h, filled=False)
-      elif op == "L":
-        points = self.read_polygon()
-        self.handle_line(points)
-      elif op == "B":
-        points = self.read_polygon()
-        self.handle_bezier(points, filled=False)
-      elif op == "b":
-        points = self.read_polygon()
-        self.handle_bezier(points, filled=True)
-      elif op == "P":
-        points = self.read_polygon()
-        self.handle_polygon(points, filled=True)
-      elif op == "p":
-        points = self.read_polygon()
-        self.handle_polygon(points, filled=False)
+        self.handle_font_characteristics(args)
+      elif op == "E" or op == "e":
+        point, w, h = args
+        x0, y0 = points[point]
+        self.handle_ellipse(x0, y0, w, h, filled=(op == "E"))
       elif op == "I":
-        x0, y0 = s.read_point()
-        w = s.read_float()
-        h = s.read_float()
-        path = s.read_text()
+        point, w, h, path = args
+        x0, y0 = points[point]
         self.handle_image(x0, y0, w, h, path)
       else:
-        sys.stderr.write("error: unknown xdot opcode '%s'\n" % op)
-        sys.exit(1)
+        start, n = args
+        polygon = points[start:start + n]
+        if op == "L":
+          self.handle_line(polygon)
+        elif op == "B" or op == "b":
+          self.handle_bezier(polygon, filled=(op == "b"))
+        else:
+          self.handle_polygon(polygon, filled=(op == "P"))
 
     return self.shapes
 
-  def transform(self, x: float, y: float) -> Tuple[float, float]:
-    return self.parser.transform(x, y)
-
   def handle_color(self, color: Tuple[float, float, float, float],
       filled: bool = False) -> None:
     if filled:
@@ -305,80 +363,80 @@ class DotParser(Parser):
     self.match(EOF)
 
   def parse_graph(self) -> None:
-    if self.lookahead.type == STRICT:
+    if self.lookahead_type == STRICT:
       self.consume()
     self.skip(LCURLY)
     self.consume()
-    while self.lookahead.type != RCURLY:
+    while self.lookahead_type != RCURLY:
       self.parse_stmt()
     self.consume()
 
   def parse_subgraph(self):
     id = None
-    if self.lookahead.type == SUBGRAPH:
+    if self.lookahead_type == SUBGRAPH:
       self.consume()
-      if self.lookahead.type == ID:
-        id = self.lookahead.text
+      if self.lookahead_type == ID:
+        id = self.lookahead_text
         self.consume()
         # A subgraph is also a node.
         self.handle_node(id, {})
-    if self.lookahead.type == LCURLY:
+    if self.lookahead_type == LCURLY:
       self.consume()
-      while self.lookahead.type != RCURLY:
+      while self.lookahead_type != RCURLY:
         self.parse_stmt()
       self.consume()
     return id
 
   def parse_stmt(self) -> None:
-    if self.lookahead.type == GRAPH:
+    if self.lookahead_type == GRAPH:
       self.consume()
       attrs = self.parse_attrs()
       self.graph_attrs.update(attrs)
       self.handle_graph(attrs)
-    elif self.lookahead.type == NODE:
+    elif self.lookahead_type == NODE:
       self.consume()
       self.node_attrs.update(self.parse_attrs())
-    elif self.lookahead.type == EDGE:
+    elif self.lookahead_type == EDGE:
       self.consume()
       self.edge_attrs.update(self.parse_attrs())
-    elif self.lookahead.type in (SUBGRAPH, LCURLY):
+    elif self.lookahead_type in (SUBGRAPH, LCURLY):
       self.parse_subgraph()
     else:
       id = self.parse_node_id()
-      if self.lookahead.type == EDGE_OP:
+      if self.lookahead_type == EDGE_OP:
         self.consume()
         node_ids = [id, self.parse_node_id()]
-        while self.lookahead.type == EDGE_OP:
+        while self.lookahead_type == EDGE_OP:
           self.consume()
           node_ids.append(self.parse_node_id())
         attrs = self.parse_attrs()
         for i in range(0, len(node_ids) - 1):
           self.handle_edge(node_ids[i], node_ids[i + 1], attrs)
-      elif self.lookahead.type == EQUAL:
+      elif self.lookahead_type == EQUAL:
         self.consume()
         self.parse_id()
       else:
         attrs = self.parse_attrs()
         self.handle_node(id, attrs)
-    if self.lookahead.type == SEMI:
+    if self.lookahead_type == SEMI:
       self.consume()
 
   def parse_attrs(self) -> Dict[str, bytes]:
     attrs = {}
-    while self.lookahead.type == LSQUARE:
+    while self.lookahead_type == LSQUARE:
       self.consume()
-      while self.lookahead.type != RSQUARE:
+      while self.lookahead_type != RSQUARE:
         name, value = self.parse_attr()
         name = name.decode('utf-8')
         attrs[name] = value
-        if self.lookahead.type == COMMA:
+        if self.lookahead_type == COMMA:
           self.consume()
       self.consume()
     return attrs
 
   def parse_attr(self) -> Tuple[bytes, bytes]:
     name = self.parse_id()
-    if self.lookahead.type == EQUAL:
+    if self.lookahead_type == EQUAL:
       self.consume()
       value = self.parse_id()
     else:
@@ -387,10 +445,10 @@ class DotParser(Parser):
 
   def parse_node_id(self) -> bytes:
     node_id = self.parse_id()
-    if self.lookahead.type == COLON:
+    if self.lookahead_type == COLON:
       self.consume()
       port = self.parse_id()
-      if self.lookahead.type == COLON:
+      if self.lookahead_type == COLON:
         self.consume()
         compass_pt = self.parse_id()
       else:
@@ -404,9 +462,7 @@ class DotParser(Parser):
 
   def parse_id(self) -> bytes:
     self.match(ID)
-    id = self.lookahead.text
-    self.consume()
-    return id
+    return self.consume()
 
   def handle_graph(self, attrs):
     pass
@@ -421,17 +477,27 @@ class DotParser(Parser):
 class XDotParser(DotParser):
   XDOTVERSION = '1.7'
 
-  def __init__(self, xdotcode: bytes) -> None:
-    lexer = DotLexer(buf=xdotcode)
+  def __init__(self, xdotcode: Optional[bytes] = None,
+      chunks: Optional[Iterable[bytes]] = None) -> None:
+    """
+    :param chunks: Parse the chunks of xdot code as they come, instead of
+                   xdotcode.
+    """
+    lexer = DotLexer(buf=xdotcode, chunks=chunks)
     DotParser.__init__(self, lexer)
 
     self.nodes = []
     self.edges = []
     self.shapes = []
     self.node_by_name = {}
+    # Arguments of the nodes and edges with draw attributes, which are made
+    # in `parse`.
+    self.node_args = []
+    self.edge_args = []
     self.top_graph = True
     self.width = 0
     self.height = 0
+    self.pos_error = 0.
     self.outputorder = 'breadthfirst'
 
   def handle_graph(self, attrs: Dict[str, bytes]) -> None:
@@ -470,6 +536,9 @@ class XDotParser(DotParser):
 
         self.width = max(xmax - xmin, 1)
         self.height = max(ymax - ymin, 1)
+        # Graphviz rounds the positions to 5 significant digits.
+        self.pos_error = 5e-5 * max(abs(xmin), abs(xmax), abs(ymin),
+                                    abs(ymax))
 
         self.top_graph = False
 
@@ -488,23 +557,19 @@ class XDotParser(DotParser):
       # create a Node object nevertheless, so that any edges to/from it
       # don't get lost.
       # TODO: Extract the position from subgraph > graph > bb attribute.
-      node = elements.Node(id, 0.0, 0.0, 0.0, 0.0, [], None)
+      node = elements.Node(id, 0.0, 0.0, 0.0, 0.0, [])
       self.node_by_name[id] = node
       return
 
     x, y = self.parse_node_pos(pos)
     w = float(attrs.get('width', 0)) * 72
     h = float(attrs.get('height', 0)) * 72
-    shapes = []
-    for attr in ("_draw_", "_ldraw_"):
-      if attr in attrs:
-        parser = XDotAttrParser(self, attrs[attr])
-        shapes.extend(parser.parse())
-
-    node = elements.Node(id, x, y, w, h, shapes)
-    self.node_by_name[id] = node
-    if shapes:
-      self.nodes.append(node)
+    draws = [attrs[attr] for attr in ("_draw_", "_ldraw_") if attr in attrs]
+    if draws:
+      bounding = self.node_bounds(x, y, id, attrs)
+      self.node_args.append((id, x, y, w, h, draws, bounding))
+    else:
+      self.node_by_name[id] = elements.Node(id, x, y, w, h, [])
 
   def handle_edge(self, src_id: bytes, dst_id: bytes,
       attrs: Dict[str, bytes]) -> None:
@@ -514,23 +579,105 @@ class XDotParser(DotParser):
       return
 
     points = self.parse_edge_pos(pos)
-    shapes = []
-    for attr in (
+    draws = [attrs[attr] for attr in (
         "_draw_", "_ldraw_", "_hdraw_", "_tdraw_", "_hldraw_",
-        "_tldraw_"):
-      if attr in attrs:
-        parser = XDotAttrParser(self, attrs[attr])
-        shapes.extend(parser.parse())
-    if shapes:
-      src = self.node_by_name[src_id]
-      dst = self.node_by_name[dst_id]
-      self.edges.append(elements.Edge(src, dst, points, shapes))
+        "_tldraw_") if attr in attrs]
+    if draws:
+      bounding = self.edge_bounds(pos, attrs)
+      self.edge_args.append((src_id, dst_id, points, draws, bounding))
 
   def parse(self) -> elements.Graph:
     DotParser.parse(self)
+    self.make_elements()
     return elements.Graph(self.width, self.height, self.shapes,
                           self.nodes, self.edges, self.outputorder)
 
+  def make_elements(self) -> None:
+    """
+    Make the nodes and edges. Their draw attributes are parsed only when
+    they are first drawn, see `DrawLoader`.
+    """
+    loader = None
+    if self.node_args or self.edge_args:
+      loader = DrawLoader((self.xoffset, self.yoffset),
+                          (self.xscale, self.yscale))
+
+    for id, x, y, w, h, draws, bounding in self.node_args:
+      node = elements.Node(id, x, y, w, h, None, bounding=bounding,
+                           draws=draws, load_shapes=loader)
+      self.node_by_name[id] = node
+      self.nodes.append(node)
+
+    for src_id, dst_id, points, draws, bounding in self.edge_args:
+      src = self.node_by_name[src_id]
+      dst = self.node_by_name[dst_id]
+      self.edges.append(elements.Edge(src, dst, points, None,
+                                      bounding=bounding, draws=draws,
+                                      load_shapes=loader))
+
+  @staticmethod
+  def float_attr(name: str, default: float,
+      *attrs: Dict[str, bytes]) -> float:
+    """Value of the attribute from the first attrs that set it."""
+    for element_attrs in attrs:
+      try:
+        return float(element_attrs[name])
+      except (KeyError, ValueError):
+        continue
+    return default
+
+  def node_bounds(self, x: float, y: float, id: bytes,
+      attrs: Dict[str, bytes]) -> Tuple[float, float, float, float]:
+    """A box around the shapes of the node, from its attributes."""
+    w = self.float_attr('width', 0.75, attrs, self.node_attrs) * 72 / 2
+    h = self.float_attr('height', 0.5, attrs, self.node_attrs) * 72 / 2
+    margin = self.float_attr('penwidth', 1., attrs, self.node_attrs) / 2 \
+             + self.pos_error
+    bounds = [(x - w - margin, y - h - margin, x + w + margin, y + h + margin)]
+    if '_ldraw_' in attrs:
+      # The label may not fit into a node of a fixed size.
+      label = attrs.get('label', self.node_attrs.get('label', id))
+      fontsize = self.float_attr('fontsize', 14., attrs, self.node_attrs)
+      bounds.append(self.label_bounds(x, y, label, fontsize))
+    return shape.Shape._envelope_bounds(bounds)
+
+  def edge_bounds(self, pos: bytes,
+      attrs: Dict[str, bytes]) -> Tuple[float, float, float, float]:
+    """A box around the shapes of the edge, from its attributes."""
+    # The points include the ends of the arrows, and the control points of
+    # the splines, which contain them.
+    coords = [entry.rsplit(b",", 2)[-2:] for entry in pos.split()]
+    points = [self.transform(float(x), float(y)) for x, y in coords]
+    margin = self.float_attr('penwidth', 1., attrs, self.edge_attrs) / 2 \
+             + self.float_attr('arrowsize', 1., attrs, self.edge_attrs) * 5 \
+             + self.pos_error
+    x0, y0, x1, y1 = shape.Shape._bounds_from_points(points)
+    bounds = [(x0 - margin, y0 - margin, x1 + margin, y1 + margin)]
+
+    fontsize = self.float_attr('fontsize', 14., attrs, self.edge_attrs)
+    labelfontsize = self.float_attr('labelfontsize', fontsize, attrs,
+                                    self.edge_attrs)
+    for lp, label, size in (('lp', 'label', fontsize),
+                            ('xlp', 'xlabel', fontsize),
+                            ('head_lp', 'headlabel', labelfontsize),
+                            ('tail_lp', 'taillabel', labelfontsize)):
+      if lp in attrs:
+        x, y = self.parse_node_pos(attrs[lp])
+        text = attrs.get(label, self.edge_attrs.get(label, b''))
+        bounds.append(self.label_bounds(x, y, text, size))
+    return shape.Shape._envelope_bounds(bounds)
+
+  def label_bounds(self, x: float, y: float, label: bytes,
+      fontsize: float) -> Tuple[float, float, float, float]:
+    """
+    A box around a label centered at x, y. The widths of the characters are
+    not known, so it is rather too wide.
+    """
+    lines = LABEL_LINES_RE.split(label)
+    w = max(map(len, lines)) * fontsize / 2 + self.pos_error
+    h = len(lines) * fontsize * LINE_SPACING / 2 + self.pos_error
+    return x - w, y - h, x + w, y + h
+
   def parse_node_pos(self, pos: bytes) -> Tuple[float, float]:
     x, y = pos.split(b",")
     return self.transform(float(x), float(y))
@@ -554,23 +701,222 @@ class XDotParser(DotParser):
     y = (y + self.yoffset) * self.yscale
     return x, y
 
+  def transform_points(self, coords: List[bytes]) -> List[Tuple[float, float]]:
+    """`transform` of the points with the given coordinates, x and y."""
+    return transform_points(coords, (self.xoffset, self.yoffset),
+                            (self.xscale, self.yscale))
+
+
+def transform_points(coords: List[bytes], offset: Tuple[float, float],
+    scale: Tuple[float, float]) -> List[Tuple[float, float]]:
+  xy = np.array(coords, dtype=float).reshape(-1, 2)
+  xy += offset
+  xy *= scale
+  return list(zip(xy[:, 0].tolist(), xy[:, 1].tolist()))
 
-def make_xdotcode(dotcode: bytes, filter: str = cfg.GRAPHVIZ_FILTER) -> bytes:
+
+class DrawLoader:
+  """
+  Parses the draw attributes of nodes and edges, once their shapes are
+  needed, see `elements.load_shapes`.
+  """
+
+  def __init__(self, offset: Tuple[float, float],
+      scale: Tuple[float, float]) -> None:
+    self.offset = offset
+    self.scale = scale
+
+  def __call__(self, element_draws: List[List[bytes]]) \
+      -> List[List[shape.Shape]]:
+    draws = [draw for element in element_draws for draw in element]
+    draw_shapes = iter(XDotAttrParser.parse_all(self, draws))
+    return [[s for _ in element for s in next(draw_shapes)]
+            for element in element_draws]
+
+  def transform_points(self, coords: List[bytes]) -> List[Tuple[float, float]]:
+    return transform_points(coords, self.offset, self.scale)
+
+
+def make_xdotcode(dotcode: bytes, filter: str = cfg.GRAPHVIZ_FILTER,
+    cache: Optional[LayoutCache] = None,
+    timeout: Optional[float] = None,
+    read_output: Optional[Callable[[Iterator[bytes]], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None) -> bytes:
   """
   Run filter to get graph with a layout to display.
 
   May raise an exception of failure.
 
   Filter options are the ones available from `man dot`.
+  :param cache: Reuse layouts of the same DOT input from this cache.
+  :param timeout: Stop the filter after this many seconds and raise
+                  `subprocess.TimeoutExpired`. The graphviz library can't be
+                  stopped, so it lays out only the small graphs then, see
+                  GRAPHVIZ_IN_PROCESS_MAX_BYTES.
+  :param read_output: If the filter runs as a process, this is called with
+                      an iterator over the chunks of its output, as they are
+                      written, see `layout_graph`.
+  :param cancelled: Stop the filter once this returns True, and raise
+                    `concurrent.futures.CancelledError`. Only the filter
+                    that runs as a process, with `read_output`, is stopped.
   :return: xdot layout.
   """
+  in_process = (cfg.GRAPHVIZ_IN_PROCESS and pygraphviz is not None
+                and (timeout is None
+                     or len(dotcode) <= cfg.GRAPHVIZ_IN_PROCESS_MAX_BYTES))
+  if cache is not None:
+    # Layouts by the library and by the filter may differ.
+    version = f"library {pygraphviz.__graphviz_version__}" \
+      if in_process else None
+    key = cache.key(dotcode, filter, version)
+    xdotcode = cache.get(key)
+    if xdotcode is not None:
+      return xdotcode
+
+  xdotcode = None
+  if in_process:
+    try:
+      xdotcode = _layout_in_process(dotcode, filter)
+    except (ValueError, OSError) as e:
+      logging.warning(f"Could not lay out the graph with the graphviz "
+                      f"library, running '{filter}' instead: {e}")
+  if xdotcode is None:
+    xdotcode, ok = _layout_in_subprocess(dotcode, filter, timeout,
+                                         read_output, cancelled)
+    if cache is not None and in_process:
+      key = cache.key(dotcode, filter)
+  else:
+    ok = True
+  if cache is not None and ok and xdotcode:
+    cache.put(key, xdotcode)
+  return xdotcode
+
+
+def _layout_in_process(dotcode: bytes, filter: str) -> bytes:
+  """Lay out the graph with the graphviz library, without a new process."""
+  graph = pygraphviz.AGraph(string=dotcode.decode())
+  try:
+    return graph.draw(format="xdot", prog=filter)
+  finally:
+    graph.close()
+
+
+def _layout_in_subprocess(dotcode: bytes, filter: str,
+    timeout: Optional[float] = None,
+    read_output: Optional[Callable[[Iterator[bytes]], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None) -> Tuple[bytes, bool]:
+  """
+  :param read_output: Called with an iterator over the chunks of the output,
+                      as they are written. The input is written by another
+                      thread meanwhile.
+  :param cancelled: Checked with `read_output`, see `make_xdotcode`.
+  :return: xdot layout, and whether the filter succeeded.
+  """
   p = subprocess.Popen([filter, '-Txdot'],
                        stdin=subprocess.PIPE,
                        stdout=subprocess.PIPE,
                        shell=False,
                        universal_newlines=False)
-  xdotcode, _ = p.communicate(dotcode)
-  return xdotcode
+  if read_output is None:
+    try:
+      xdotcode, _ = p.communicate(dotcode, timeout=timeout)
+    except subprocess.TimeoutExpired:
+      p.kill()
+      p.communicate()
+      raise
+    return xdotcode, p.returncode == 0
+
+  # Why the filter was stopped, if it was.
+  stopped = []
+  done = threading.Event()
+
+  def watch():
+    end = None if timeout is None else time.monotonic() + timeout
+    while True:
+      wait = CANCEL_CHECK_INTERVAL if cancelled is not None else None
+      if end is not None:
+        remaining = max(0., end - time.monotonic())
+        wait = remaining if wait is None else min(wait, remaining)
+      if done.wait(wait):
+        return
+      if end is not None and time.monotonic() >= end:
+        stopped.append(subprocess.TimeoutExpired(p.args, timeout))
+      elif cancelled is not None and cancelled():
+        stopped.append(concurrent.futures.CancelledError())
+      else:
+        continue
+      p.kill()
+      return
+
+  watcher = None
+  if timeout is not None or cancelled is not None:
+    watcher = threading.Thread(target=watch, daemon=True)
+  writer = threading.Thread(target=_write_input, args=(p.stdin, dotcode),
+                            daemon=True)
+  chunks = []
+
+  def read_chunks():
+    read = functools.partial(p.stdout.read1, OUTPUT_CHUNK_SIZE)
+    for chunk in iter(read, b''):
+      chunks.append(chunk)
+      yield chunk
+
+  writer.start()
+  if watcher is not None:
+    watcher.start()
+  try:
+    read_output(read_chunks())
+    # The rest of the output, if read_output did not read it all.
+    for _ in read_chunks():
+      pass
+  except Exception:
+    p.kill()
+    # The output of a stopped filter is likely incomplete.
+    if not stopped:
+      raise
+  finally:
+    done.set()
+    if watcher is not None:
+      watcher.join()
+    writer.join()
+    p.stdout.close()
+    p.wait()
+  if stopped:
+    raise stopped[0]
+  return b''.join(chunks), p.returncode == 0
+
+
+def _write_input(stdin, dotcode: bytes) -> None:
+  try:
+    stdin.write(dotcode)
+  except BrokenPipeError:
+    # The filter exited early, its exit status tells why.
+    pass
+  finally:
+    try:
+      stdin.close()
+    except BrokenPipeError:
+      pass
+
+
+def layout_graph(dotcode: bytes, filter: str = cfg.GRAPHVIZ_FILTER,
+    cache: Optional[LayoutCache] = None,
+    timeout: Optional[float] = None,
+    cancelled: Optional[Callable[[], bool]] = None) -> elements.Graph:
+  """
+  Lay out the graph and parse the layout, like
+  `make_graph(make_xdotcode(...))`. If the filter runs as a process, its
+  output is parsed while it is written, rather than after it exits.
+  """
+  graphs = []
+  xdotcode = make_xdotcode(
+      dotcode, filter, cache, timeout,
+      read_output=lambda chunks: graphs.append(
+          XDotParser(chunks=chunks).parse()),
+      cancelled=cancelled)
+  if graphs:
+    return graphs[0]
+  return make_graph(xdotcode)
 
 
 def make_parser(xdotcode: bytes) -> XDotParser:
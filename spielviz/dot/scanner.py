@@ -45,6 +45,9 @@ class Scanner:
                    for type, regexp, test_lit in self.tokens]),
         flags
     )
+    # The tokens or any other char (a symbol, see `next`), so that
+    # consecutive matches cover the whole buffer.
+    self.sweep_re = re.compile(self.tokens_re.pattern + b'|(.)', flags)
 
   def next(self, buf: bytes, pos: int) -> Tuple[int, bytes, int]:
     if pos >= len(buf):
@@ -8,6 +8,28 @@ _inf = float('inf')
 _get_bounding = operator.attrgetter('bounding')
 
 
+def load_shapes(elements):
+  """
+  Load the shapes of the elements that are not loaded yet, in bulk.
+
+  The load_shapes function of the elements gets a list of their draws, and
+  returns the list of their shapes.
+  """
+  by_loader = dict()
+  for element in elements:
+    if not element.loaded:
+      by_loader.setdefault(element.load_shapes, []).append(element)
+  for loader, group in by_loader.items():
+    for element, shapes in zip(group, loader([e.draws for e in group])):
+      dx, dy = element.offset
+      if dx or dy:
+        for shape in shapes:
+          shape.translate(dx, dy)
+      element.shapes = shapes
+      element.draws = None
+      element.load_shapes = None
+
+
 class Jump(object):
   def __init__(self, item, x, y, highlight=None):
     self.item = item
@@ -19,10 +41,47 @@ class Jump(object):
 
 
 class Element(CompoundShape):
-  """Base class for graph nodes and edges."""
-
-  def __init__(self, shapes):
-    CompoundShape.__init__(self, shapes)
+  """
+  Base class for graph nodes and edges.
+
+  The shapes can be loaded lazily, when they are first needed: then pass
+  a bounding box of the shapes instead, which is kept (it may be larger than
+  theirs), and the draws, which load_shapes turns into the shapes, see
+  `load_shapes`.
+  """
+
+  def __init__(self, shapes, bounding=None, draws=None, load_shapes=None):
+    if load_shapes is None:
+      CompoundShape.__init__(self, shapes)
+    else:
+      Shape.__init__(self)
+      self._shapes = None
+      self.bounding = bounding
+    self.draws = draws
+    self.load_shapes = load_shapes
+    # Translation of the shapes that are not loaded yet.
+    self.offset = (0., 0.)
+
+  @property
+  def shapes(self):
+    if self._shapes is None:
+      load_shapes([self])
+    return self._shapes
+
+  @shapes.setter
+  def shapes(self, shapes):
+    self._shapes = shapes
+
+  @property
+  def loaded(self):
+    return self._shapes is not None
+
+  def translate(self, dx, dy):
+    if self.loaded:
+      CompoundShape.translate(self, dx, dy)
+    else:
+      self.offset = (self.offset[0] + dx, self.offset[1] + dy)
+      self.bounding = Shape._translate_bounds(self.bounding, dx, dy)
 
   def is_inside(self, x, y):
     return False
@@ -32,8 +91,8 @@ class Element(CompoundShape):
 
 
 class Node(Element):
-  def __init__(self, id, x, y, w, h, shapes):
-    Element.__init__(self, shapes)
+  def __init__(self, id, x, y, w, h, shapes, **kwargs):
+    Element.__init__(self, shapes, **kwargs)
 
     self.id = id
     self.x = x
@@ -52,6 +111,15 @@ class Node(Element):
       return Jump(self, self.x, self.y)
     return None
 
+  def translate(self, dx, dy):
+    Element.translate(self, dx, dy)
+    self.x += dx
+    self.y += dy
+    self.x1 += dx
+    self.y1 += dy
+    self.x2 += dx
+    self.y2 += dy
+
   def __repr__(self):
     return "<Node %s>" % self.id
 
@@ -63,8 +131,8 @@ def square_distance(x1, y1, x2, y2):
 
 
 class Edge(Element):
-  def __init__(self, src, dst, points, shapes):
-    Element.__init__(self, shapes)
+  def __init__(self, src, dst, points, shapes, **kwargs):
+    Element.__init__(self, shapes, **kwargs)
     self.src = src
     self.dst = dst
     self.points = points
@@ -95,6 +163,10 @@ class Edge(Element):
                   highlight=set([self, self.src]))
     return None
 
+  def translate(self, dx, dy):
+    Element.translate(self, dx, dy)
+    self.points = Shape._translate_points(self.points, dx, dy)
+
   def __repr__(self):
     return "<Edge %s -> %s>" % (self.src, self.dst)
 
@@ -110,6 +182,8 @@ class Graph(Shape):
     self.nodes = nodes
     self.edges = edges
     self.outputorder = outputorder
+    # Whether a cheaper layout was used, as the usual one took too long.
+    self.fast_layout = False
 
     self.bounding = Shape._envelope_bounds(
         map(_get_bounding, self.shapes),
@@ -124,20 +198,37 @@ class Graph(Shape):
       if bounding is None or shape._intersects(bounding):
         shape._draw(cr, highlight=False, bounding=bounding)
 
-  def _draw_nodes(self, cr, bounding, highlight_items):
-    for node in self.nodes:
-      if bounding is None or node._intersects(bounding):
-        node._draw(cr, highlight=(node in highlight_items),
-                   bounding=bounding)
-
-  def _draw_edges(self, cr, bounding, highlight_items):
-    for edge in self.edges:
-      if bounding is None or edge._intersects(bounding):
-        should_highlight = any(e in highlight_items
-                               for e in (edge, edge.src, edge.dst))
-        edge._draw(cr, highlight=should_highlight, bounding=bounding)
-
-  def draw(self, cr, highlight_items=None, bounding=None):
+  @staticmethod
+  def _is_shown(element, bounding, min_size, highlight):
+    if bounding is not None and not element._intersects(bounding):
+      return False
+    x0, y0, x1, y1 = element.bounding
+    return highlight or x1 - x0 >= min_size or y1 - y0 >= min_size
+
+  def _draw_nodes(self, cr, bounding, highlight_items, min_size):
+    nodes = [(node, node in highlight_items) for node in self.nodes]
+    nodes = [(node, highlight) for node, highlight in nodes
+             if self._is_shown(node, bounding, min_size, highlight)]
+    load_shapes(node for node, _ in nodes)
+    for node, highlight in nodes:
+      node._draw(cr, highlight=highlight, bounding=bounding)
+
+  def _draw_edges(self, cr, bounding, highlight_items, min_size):
+    edges = [(edge, any(e in highlight_items
+                        for e in (edge, edge.src, edge.dst)))
+             for edge in self.edges]
+    edges = [(edge, highlight) for edge, highlight in edges
+             if self._is_shown(edge, bounding, min_size, highlight)]
+    load_shapes(edge for edge, _ in edges)
+    for edge, highlight in edges:
+      edge._draw(cr, highlight=highlight, bounding=bounding)
+
+  def draw(self, cr, highlight_items=None, bounding=None, min_size=0):
+    """
+    :param min_size: Skip the nodes and edges that are smaller than this in
+                     both directions, unless they are highlighted. Their
+                     shapes are not even loaded.
+    """
     if bounding is not None:
       if not self._intersects(bounding):
         return
@@ -153,11 +244,11 @@ class Graph(Shape):
 
     self._draw_shapes(cr, bounding)
     if self.outputorder == 'edgesfirst':
-      self._draw_edges(cr, bounding, highlight_items)
-      self._draw_nodes(cr, bounding, highlight_items)
+      self._draw_edges(cr, bounding, highlight_items, min_size)
+      self._draw_nodes(cr, bounding, highlight_items, min_size)
     else:
-      self._draw_nodes(cr, bounding, highlight_items)
-      self._draw_edges(cr, bounding, highlight_items)
+      self._draw_nodes(cr, bounding, highlight_items, min_size)
+      self._draw_edges(cr, bounding, highlight_items, min_size)
 
   def get_element(self, x, y):
     for node in self.nodes:
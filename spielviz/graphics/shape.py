@@ -35,6 +35,10 @@ class Shape:
     if bounding is None or self._intersects(bounding):
       self._draw(cr, highlight, bounding)
 
+  def translate(self, dx, dy):
+    """Move the shape by dx, dy."""
+    raise NotImplementedError
+
   def select_pen(self, highlight):
     if highlight:
       if not hasattr(self, 'highlight_pen'):
@@ -56,6 +60,15 @@ class Shape:
       y0, y1 = min(y0, y), max(y1, y)
     return x0, y0, x1, y1
 
+  @staticmethod
+  def _translate_bounds(bounding, dx, dy):
+    x0, y0, x1, y1 = bounding
+    return x0 + dx, y0 + dy, x1 + dx, y1 + dy
+
+  @staticmethod
+  def _translate_points(points, dx, dy):
+    return [(x + dx, y + dy) for x, y in points]
+
   @staticmethod
   def _envelope_bounds(*args):
     xa = ya = _inf
@@ -171,6 +184,10 @@ class TextShape(Shape):
   def search_text(self, regexp):
     return regexp.search(self.t) is not None
 
+  def translate(self, dx, dy):
+    self.x += dx
+    self.y += dy
+
   @property
   def bounding(self):
     x, w, j = self.x, self.w, self.j
@@ -198,6 +215,10 @@ class ImageShape(Shape):
     cr.paint()
     cr.restore()
 
+  def translate(self, dx, dy):
+    self.x0 += dx
+    self.y0 += dy
+
   @property
   def bounding(self):
     x0, y0 = self.x0, self.y0
@@ -231,6 +252,10 @@ class EllipseShape(Shape):
       cr.set_source_rgba(*pen.color)
       cr.stroke()
 
+  def translate(self, dx, dy):
+    self.x0 += dx
+    self.y0 += dy
+
   @property
   def bounding(self):
     x0, y0, w, h = self.x0, self.y0, self.w, self.h
@@ -267,6 +292,10 @@ class PolygonShape(Shape):
       cr.set_source_rgba(*pen.color)
       cr.stroke()
 
+  def translate(self, dx, dy):
+    self.points = Shape._translate_points(self.points, dx, dy)
+    self.bounding = Shape._translate_bounds(self.bounding, dx, dy)
+
 
 class LineShape(Shape):
   def __init__(self, pen, points):
@@ -289,6 +318,10 @@ class LineShape(Shape):
     cr.set_source_rgba(*pen.color)
     cr.stroke()
 
+  def translate(self, dx, dy):
+    self.points = Shape._translate_points(self.points, dx, dy)
+    self.bounding = Shape._translate_bounds(self.bounding, dx, dy)
+
 
 class BezierShape(Shape):
   def __init__(self, pen, points, filled=False):
@@ -373,6 +406,10 @@ class BezierShape(Shape):
       cr.set_source_rgba(*pen.color)
       cr.stroke()
 
+  def translate(self, dx, dy):
+    self.points = Shape._translate_points(self.points, dx, dy)
+    self.bounding = Shape._translate_bounds(self.bounding, dx, dy)
+
 
 class CompoundShape(Shape):
   def __init__(self, shapes):
@@ -392,3 +429,8 @@ class CompoundShape(Shape):
       if shape.search_text(regexp):
         return True
     return False
+
+  def translate(self, dx, dy):
+    for shape in self.shapes:
+      shape.translate(dx, dy)
+    self.bounding = Shape._translate_bounds(self.bounding, dx, dy)
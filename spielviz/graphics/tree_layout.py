@@ -0,0 +1,969 @@
+"""
+Tidy tree layout of a `GameTree`, an alternative to laying out the tree
+with graphviz.
+
+The nodes are placed with the Walker's algorithm in the linear time version
+of Buchheim, Jünger and Leipert: every subtree is drawn as compactly as
+possible, parents are centered above their children and identical subtrees
+are drawn identically. The positioned elements are produced directly,
+without writing and parsing DOT / xdot.
+"""
+
+import concurrent.futures
+import functools
+import subprocess
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pyspiel
+
+import spielviz.config as cfg
+from spielviz.dot.layout_cache import LayoutCache
+from spielviz.dot.parser import layout_graph
+from spielviz.graphics import elements, shape
+from spielviz.graphics.pen import Pen
+from spielviz.logic.game_tree import GameTree
+from spielviz.logic.workers import CANCEL_CHECK_INTERVAL, \
+  discard_executor, submit_all
+
+# Distances in points, the same defaults as graphviz uses.
+NODE_SEP = 0.25 * 72
+RANK_SEP = 0.25 * 72
+# Gap between an edge and its label.
+LABEL_GAP = 2.
+FONT_NAME = "Times-Roman"
+
+
+def _text_width(text: str) -> float:
+  """Rough width of the text; TextShape shrinks the text to fit into it."""
+  return 0.6 * cfg.PLOT_FONTSIZE * len(text)
+
+
+def _line_height() -> float:
+  return 1.2 * cfg.PLOT_FONTSIZE
+
+
+def _color(color: str) -> Tuple[float, float, float, float]:
+  if color.startswith("#") and len(color) in (7, 9):
+    channels = [int(color[i:i + 2], 16) / 255. for i in range(1, len(color), 2)]
+    return tuple(channels) if len(channels) == 4 else (*channels, 1.)
+  return 0., 0., 0., 1.
+
+
+@functools.lru_cache(maxsize=None)
+def _pen(color: str, linewidth: float = 1., style: str = "solid") -> Pen:
+  """Shared pen, the shapes make their own copies."""
+  pen = Pen()
+  pen.color = pen.fillcolor = _color(color)
+  pen.linewidth = linewidth
+  pen.fontsize = cfg.PLOT_FONTSIZE
+  pen.fontname = FONT_NAME
+  if style == "dashed":
+    pen.dash = (6,)  # 6pt on, 6pt off
+  elif style == "dotted":
+    pen.dash = (2, 4)  # 2pt on, 4pt off
+  return pen
+
+
+def _text_shapes(lines: List[str], x: float, y: float,
+    j: int) -> List[shape.Shape]:
+  """Lines of text with the first baseline at y."""
+  pen = _pen("#000000")
+  return [shape.TextShape(pen, x, y + i * _line_height(), j, _text_width(line),
+                          line)
+          for i, line in enumerate(lines)]
+
+
+def _node_size(node_shape: str, width: float, height: float,
+    label: str) -> Tuple[float, float]:
+  """Size of the node in points, grown to fit its label."""
+  w, h = width * 72, height * 72
+  if label:
+    text_w = _text_width(label) + 2 * cfg.PLOT_MARGIN * 72
+    text_h = _line_height() + 2 * cfg.PLOT_MARGIN * 72
+    if node_shape == "diamond":
+      text_w, text_h = 2 * text_w, 2 * text_h
+    elif node_shape == "circle":
+      text_w = text_h = 1.42 * max(text_w, text_h)
+    w, h = max(w, text_w), max(h, text_h)
+  if node_shape in ("square", "circle"):
+    w = h = max(w, h)
+  return w, h
+
+
+def _node_shapes(node_shape: str, pen: Pen, x: float, y: float, w: float,
+    h: float, label: str) -> List[shape.Shape]:
+  if node_shape == "circle":
+    shapes = [shape.EllipseShape(pen, x, y, w / 2, h / 2)]
+  elif node_shape == "diamond":
+    shapes = [shape.PolygonShape(pen, [(x, y - h / 2), (x + w / 2, y),
+                                       (x, y + h / 2), (x - w / 2, y)])]
+  else:
+    shapes = [shape.PolygonShape(pen, [(x - w / 2, y - h / 2),
+                                       (x + w / 2, y - h / 2),
+                                       (x + w / 2, y + h / 2),
+                                       (x - w / 2, y + h / 2)])]
+  if label:
+    baseline = y + _line_height() / 2 - 2
+    shapes.extend(_text_shapes([label], x, baseline, 0))
+  return shapes
+
+
+def _arrow_shapes(pen: Pen, x: float, y: float, dx: float,
+    dy: float) -> List[shape.Shape]:
+  """Arrowhead with the tip at (x, y), pointing in the direction (dx, dy)."""
+  length = 10 * cfg.PLOT_ARROWSIZE
+  norm = max((dx * dx + dy * dy) ** .5, 1e-9)
+  dx, dy = dx / norm * length, dy / norm * length
+  points = [(x, y), (x - dx - dy / 3, y - dy + dx / 3),
+            (x - dx + dy / 3, y - dy - dx / 3)]
+  return [shape.PolygonShape(pen, points, filled=True)]
+
+
+def _node_pen_attrs(player: int, terminal: bool,
+    flags: int) -> Tuple[str, float, str]:
+  """:return: Color, line width and style of the node."""
+  if terminal:
+    color = cfg.PLAYER_COLORS[pyspiel.PlayerId.TERMINAL]
+  else:
+    color = cfg.PLAYER_COLORS.get(player, "black")
+  style = "solid"
+  if flags & GameTree.TRUNCATED:
+    style = cfg.PLOT_TRUNCATED_STYLE
+  if flags & GameTree.COLLAPSED:
+    style = cfg.PLOT_COLLAPSED_STYLE
+  linewidth = cfg.PLOT_HIGHLIGHT_PENWIDTH if flags & GameTree.HIGHLIGHT else 1.
+  return color, linewidth, style
+
+
+class _Walker:
+  """
+  Preliminary x coordinates of the nodes, relative to their parents.
+
+  The nodes are visited in the reverse order of their ids: the parent of
+  a node always has a smaller id, so every subtree is finished before its
+  root is visited. The root then places its children one by one, and pushes
+  each of them apart from its left siblings (`_apportion`).
+
+  The last node is a virtual root, the parent of the real roots, and it is
+  visited last.
+
+  Subtrees that are already placed are skipped: their roots and the nodes
+  below them are `placed`, with the preliminary coordinates filled in by
+  the caller.
+  """
+
+  def __init__(self, parents: List[int], children: List[List[int]],
+      left: List[float], right: List[float],
+      placed: Optional[List[bool]] = None):
+    n = len(parents)
+    self.parents = parents
+    self.children = children
+    self.left = left
+    self.right = right
+    self.placed = placed or [False] * n
+    self.number = [0] * n
+    for siblings in children:
+      for i, child in enumerate(siblings):
+        self.number[child] = i
+    self.prelim = [0.] * n
+    self.mod = [0.] * n
+    self.shift = [0.] * n
+    self.change = [0.] * n
+    self.thread = [-1] * n
+    self.ancestor = list(range(n))
+    # Preliminary x coordinate of the midpoint of the children.
+    self.midpoint = [0.] * n
+
+  def run(self):
+    virtual_root = len(self.parents) - 1
+    for v in [*reversed(range(virtual_root)), virtual_root]:
+      siblings = self.children[v]
+      if not siblings or self.placed[v]:
+        continue
+      default_ancestor = siblings[0]
+      for i, w in enumerate(siblings):
+        if i:
+          left_sibling = siblings[i - 1]
+          self.prelim[w] = self.prelim[left_sibling] \
+                           + self._distance(left_sibling, w)
+          if self.children[w]:
+            self.mod[w] = self.prelim[w] - self.midpoint[w]
+        else:
+          self.prelim[w] = self.midpoint[w]
+        default_ancestor = self._apportion(w, default_ancestor)
+      self._execute_shifts(v)
+      self.midpoint[v] = (self.prelim[siblings[0]]
+                          + self.prelim[siblings[-1]]) / 2
+
+  def _distance(self, a: int, b: int) -> float:
+    return self.right[a] + self.left[b] + NODE_SEP
+
+  def _next_left(self, v: int) -> int:
+    children = self.children[v]
+    return children[0] if children else self.thread[v]
+
+  def _next_right(self, v: int) -> int:
+    children = self.children[v]
+    return children[-1] if children else self.thread[v]
+
+  def _apportion(self, v: int, default_ancestor: int) -> int:
+    i = self.number[v]
+    if not i:
+      return default_ancestor
+    siblings = self.children[self.parents[v]]
+    prelim, mod = self.prelim, self.mod
+    # Inner and outer contours of the subtree of v (right, "ir" / "or")
+    # and of the left siblings (left, "il" / "ol"), with sums of the modifiers.
+    vir = vor = v
+    vil = siblings[i - 1]
+    vol = siblings[0]
+    sir = sor = mod[v]
+    sil = mod[vil]
+    sol = mod[vol]
+    next_right, next_left = self._next_right, self._next_left
+    while next_right(vil) >= 0 and next_left(vir) >= 0:
+      vil = next_right(vil)
+      vir = next_left(vir)
+      vol = next_left(vol)
+      vor = next_right(vor)
+      self.ancestor[vor] = v
+      shift = (prelim[vil] + sil) - (prelim[vir] + sir) \
+              + self._distance(vil, vir)
+      if shift > 0:
+        self._move_subtree(self._ancestor(vil, v, default_ancestor), v, shift)
+        sir += shift
+        sor += shift
+      sil += mod[vil]
+      sir += mod[vir]
+      sol += mod[vol]
+      sor += mod[vor]
+    if next_right(vil) >= 0 and next_right(vor) < 0:
+      self.thread[vor] = next_right(vil)
+      mod[vor] += sil - sor
+    if next_left(vir) >= 0 and next_left(vol) < 0:
+      self.thread[vol] = next_left(vir)
+      mod[vol] += sir - sol
+      default_ancestor = v
+    return default_ancestor
+
+  def _ancestor(self, vil: int, v: int, default_ancestor: int) -> int:
+    ancestor = self.ancestor[vil]
+    if self.parents[ancestor] == self.parents[v]:
+      return ancestor
+    return default_ancestor
+
+  def _move_subtree(self, wl: int, wr: int, shift: float):
+    subtrees = self.number[wr] - self.number[wl]
+    self.change[wr] -= shift / subtrees
+    self.shift[wr] += shift
+    self.change[wl] += shift / subtrees
+    self.prelim[wr] += shift
+    self.mod[wr] += shift
+
+  def _execute_shifts(self, v: int):
+    shift = change = 0.
+    for w in reversed(self.children[v]):
+      self.prelim[w] += shift
+      self.mod[w] += shift
+      change += self.change[w]
+      shift += self.shift[w] + change
+
+
+class _Structure(NamedTuple):
+  """What the placement of the nodes depends on."""
+  keys: List[str]
+  parents: List[int]
+  players: List[int]
+  terminals: List[bool]
+  node_labels: List[str]
+  srcs: List[int]
+  dsts: List[int]
+  edge_labels: List[str]
+
+  @staticmethod
+  def of(tree: GameTree) -> "_Structure":
+    n, num_edges = tree.num_nodes, tree.num_edges
+    labels = tree.labels
+    return _Structure(
+        list(tree.keys),
+        tree.node_parent[:n].tolist(),
+        tree.node_player[:n].tolist(),
+        tree.node_terminal[:n].tolist(),
+        [labels[label] for label in tree.node_label[:n].tolist()],
+        tree.edge_src[:num_edges].tolist(),
+        tree.edge_dst[:num_edges].tolist(),
+        [labels[label] for label in tree.edge_label[:num_edges].tolist()])
+
+
+class _Placement(NamedTuple):
+  x: List[float]
+  y: List[float]
+  width: List[float]
+  height: List[float]
+  node_shapes: List[str]
+  # Where the edges into each level turn to their nodes.
+  bus_y: List[float]
+  # For each node, the edge from its parent in the laid out tree, or -1.
+  tree_edge: List[int]
+  graph_width: float
+  graph_height: float
+  # For each node, a hash of everything the placement of its subtree
+  # relative to the node depends on, if the layout is incremental.
+  signatures: Optional[List[int]] = None
+
+
+def _subtree_signatures(keys: List[str], children: List[List[int]],
+    left: List[float], right: List[float]) -> List[int]:
+  """Hashes of the keys and sizes of the nodes in each subtree."""
+  signatures = [0] * len(keys)
+  for node in range(len(keys) - 1, -1, -1):
+    signatures[node] = hash((keys[node], left[node], right[node],
+                             tuple([signatures[child]
+                                    for child in children[node]])))
+  return signatures
+
+
+def _reused_subtrees(keys: List[str], parents: np.ndarray,
+    by_depth: np.ndarray, level_starts: np.ndarray, signatures: List[int],
+    last: _Placement, last_index: Dict[str, int]) \
+    -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Find the subtrees that are the same as in the last layout, so they keep
+  their placement.
+
+  :return: For each node, its id in the last layout, and the root of
+           the largest reused subtree that contains it (-1 if none).
+  """
+  n = len(keys)
+  last_ids = np.array([last_index.get(key, -1) for key in keys],
+                      dtype=np.int64)
+  reused = last_ids >= 0
+  reused[reused] = (np.array(last.signatures, dtype=np.int64)[last_ids[reused]]
+                    == np.array(signatures, dtype=np.int64)[reused])
+  has_parent = parents >= 0
+  is_root = reused & ~(has_parent & reused[np.where(has_parent, parents, 0)])
+  root_of = np.where(is_root, np.arange(n), -1)
+  for depth in range(1, len(level_starts) - 1):
+    level = by_depth[level_starts[depth]:level_starts[depth + 1]]
+    inner = level[reused[level] & ~is_root[level]]
+    root_of[inner] = root_of[parents[inner]]
+  return last_ids, root_of
+
+
+def _place(tree: GameTree, structure: _Structure, incremental: bool = False,
+    last: Optional[_Placement] = None,
+    last_index: Optional[Dict[str, int]] = None) -> _Placement:
+  """
+  Place the nodes of the tree.
+
+  :param incremental: Compute what is needed to reuse the placement
+                      by the next one.
+  :param last: The last incremental placement. The subtrees that did not
+               change keep their relative coordinates, only the rest of
+               the tree is placed anew.
+  :param last_index: Ids of the nodes in the last placement, by their keys.
+  """
+  n = tree.num_nodes
+  parents = tree.node_parent[:n]
+  depths = tree.node_depth[:n]
+  players, terminals = structure.players, structure.terminals
+
+  # Edges that make up the tree: the first edge into each node from its
+  # parent. The remaining ones join transpositions.
+  srcs = tree.edge_src[:tree.num_edges]
+  dsts = tree.edge_dst[:tree.num_edges]
+  tree_edge = np.full(n, -1, dtype=np.int64)
+  edges_in_tree = np.flatnonzero(parents[dsts] == srcs)
+  # Reversed, so that the first edge wins.
+  tree_edge[dsts[edges_in_tree[::-1]]] = edges_in_tree[::-1]
+  tree_edge = tree_edge.tolist()
+  edge_lines = [structure.edge_labels[edge].split("\n") if edge >= 0 else []
+                for edge in tree_edge]
+
+  # Sizes of the nodes, by their classes.
+  class_attrs = dict()
+  node_shapes = []
+  width = np.empty(n)
+  height = np.empty(n)
+  for node in range(n):
+    node_class = (players[node], terminals[node])
+    attrs = class_attrs.get(node_class)
+    if attrs is None:
+      attrs = GameTree._node_class_attrs(*node_class)
+      class_attrs[node_class] = attrs
+    node_shapes.append(attrs["shape"])
+    width[node], height[node] = _node_size(
+        attrs["shape"], attrs["width"], attrs["height"],
+        structure.node_labels[node])
+
+  # Each node takes the space of its shape, and of the label of the edge
+  # that leads to it, which is written to the right of the edge.
+  label_width = np.array([max(map(_text_width, lines), default=0.)
+                          for lines in edge_lines])
+  left = width / 2
+  right = np.maximum(width / 2,
+                     np.where(label_width > 0,
+                              LABEL_GAP + label_width, 0.))
+
+  # Roots are the children of a virtual node with id n.
+  parent_list = structure.parents
+  children = [[] for _ in range(n + 1)]
+  for node, parent in enumerate(parent_list):
+    children[parent if parent >= 0 else n].append(node)
+  left_list, right_list = left.tolist(), right.tolist()
+  max_depth = int(depths.max())
+  by_depth = np.argsort(depths, kind="stable")
+  level_starts = np.searchsorted(depths[by_depth], np.arange(max_depth + 2))
+
+  signatures = None
+  if incremental:
+    signatures = _subtree_signatures(structure.keys, children, left_list,
+                                     right_list)
+  if signatures is not None and last is not None \
+      and last.signatures is not None:
+    last_ids, root_of = _reused_subtrees(structure.keys, parents, by_depth,
+                                         level_starts, signatures, last,
+                                         last_index)
+  else:
+    last_ids, root_of = None, np.full(n, -1)
+
+  # The Walker places the nodes outside the reused subtrees, and the roots
+  # of the reused subtrees, which stand for the whole subtrees by their
+  # outlines: the leftmost and the rightmost node of each level.
+  walked = (root_of < 0) | (root_of == np.arange(n))
+  ids = np.flatnonzero(walked)
+  num_walked = len(ids)
+  compact = np.full(n + 1, -1, dtype=np.int64)
+  compact[ids] = np.arange(num_walked)
+  inner = np.flatnonzero(~walked)
+  outlines: Dict[int, List[Tuple[float, float, float, float]]] = dict()
+  if len(inner):
+    last_x = np.array(last.x)
+    roots = root_of[inner]
+    rel_depth = depths[inner] - depths[roots]
+    rel_x = last_x[last_ids[inner]] - last_x[last_ids[roots]]
+    order = np.lexsort((rel_x, rel_depth, roots))
+    starts = np.flatnonzero(np.diff(roots[order], prepend=-1)
+                            | np.diff(rel_depth[order], prepend=-1))
+    ends = np.append(starts[1:], len(order)) - 1
+    for start, end in zip(starts.tolist(), ends.tolist()):
+      first, final = order[start], order[end]
+      outlines.setdefault(int(roots[first]), []).append(
+          (float(rel_x[first]), left_list[inner[first]],
+           float(rel_x[final]), right_list[inner[final]]))
+  num_outline = sum(2 * len(outline) for outline in outlines.values())
+  virtual_root = num_walked + num_outline
+
+  walker_parents = [virtual_root] * (virtual_root + 1)
+  walker_children = [[] for _ in range(virtual_root + 1)]
+  walker_left = [0.] * (virtual_root + 1)
+  walker_right = [0.] * (virtual_root + 1)
+  walker_depths = [0] * (virtual_root + 1)
+  placed = [False] * (virtual_root + 1)
+  for i, node in enumerate(ids.tolist()):
+    parent = parent_list[node]
+    walker_parents[i] = int(compact[parent]) if parent >= 0 else virtual_root
+    walker_children[walker_parents[i]].append(i)
+    walker_left[i] = left_list[node]
+    walker_right[i] = right_list[node]
+    walker_depths[i] = int(depths[node])
+  walker_parents[virtual_root] = -1
+  # The outline of a reused subtree is a chain of its leftmost nodes and
+  # a chain of its rightmost nodes below its root.
+  outline_x = dict()
+  next_id = num_walked
+  for root, outline in outlines.items():
+    root = int(compact[root])
+    placed[root] = True
+    leftmost = rightmost = root
+    for depth, (lx, lw, rx, rw) in enumerate(outline, 1):
+      lo, ro = next_id, next_id + 1
+      next_id += 2
+      walker_parents[lo], walker_parents[ro] = leftmost, rightmost
+      walker_children[leftmost].append(lo)
+      walker_children[rightmost].append(ro)
+      walker_depths[lo] = walker_depths[ro] = walker_depths[root] + depth
+      walker_left[lo], walker_right[ro] = lw, rw
+      placed[lo] = placed[ro] = True
+      outline_x[lo], outline_x[ro] = lx, rx
+      leftmost, rightmost = lo, ro
+  walker = _Walker(walker_parents, walker_children, walker_left, walker_right,
+                   placed)
+  # Relative to the roots of the reused subtrees, centered at 0.
+  for i, x_i in outline_x.items():
+    walker.prelim[i] = x_i
+  walker.run()
+
+  # Absolute x coordinates, one level at a time.
+  walker_parents = np.array(walker_parents[:virtual_root], dtype=np.int64)
+  walker_depths = np.array(walker_depths[:virtual_root], dtype=np.int64)
+  prelim = np.array(walker.prelim[:virtual_root])
+  mod = np.array(walker.mod[:virtual_root])
+  walker_x = prelim.copy()
+  mod_sum = np.zeros(virtual_root)
+  walker_by_depth = np.argsort(walker_depths, kind="stable")
+  walker_starts = np.searchsorted(walker_depths[walker_by_depth],
+                                  np.arange(int(walker_depths.max()) + 2))
+  for depth in range(1, len(walker_starts) - 1):
+    level = walker_by_depth[walker_starts[depth]:walker_starts[depth + 1]]
+    level_parents = walker_parents[level]
+    mod_sum[level] = mod_sum[level_parents] + mod[level_parents]
+    walker_x[level] += mod_sum[level]
+  x = np.empty(n)
+  x[ids] = walker_x[:num_walked]
+  if len(inner):
+    x[inner] = x[roots] + rel_x
+
+  # Levels are as tall as their tallest node, and the gaps between them
+  # fit the edge labels.
+  level_height = np.zeros(max_depth + 1)
+  np.maximum.at(level_height, depths, height)
+  label_lines = np.array([len(lines) if lines != [""] else 0
+                          for lines in edge_lines])
+  level_lines = np.zeros(max_depth + 1)
+  np.maximum.at(level_lines, depths, label_lines)
+  gaps = RANK_SEP + level_lines * _line_height()
+  level_top = np.concatenate(([0.], np.cumsum(level_height[:-1] + gaps[1:])))
+  y = level_top[depths] + level_height[depths] / 2
+  bus_y = level_top - gaps + RANK_SEP / 2
+
+  pad = NODE_SEP / 2
+  x_min = float(np.min(x - left))
+  x = x - x_min + pad
+  graph_width = float(np.max(x + right)) + pad
+  graph_height = float(np.max(y + height / 2)) + pad
+  y = y + pad
+  bus_y = bus_y + pad
+  return _Placement(x.tolist(), y.tolist(), width.tolist(), height.tolist(),
+                    node_shapes, bus_y.tolist(), tree_edge,
+                    graph_width, graph_height, signatures)
+
+
+class TreeLayout:
+  """
+  Tidy tree layout that builds on the previous one.
+
+  If the tree has the same structure as the last one, for example when only
+  the highlighted trajectory moved, the placement of the nodes is reused.
+  Otherwise the subtrees that did not change keep their placement relative
+  to their roots, and only the rest of the tree is placed anew. Elements
+  whose position and look did not change are reused as well, so only
+  the changed parts of the tree get new shapes.
+  """
+
+  def __init__(self, incremental: bool = cfg.LAYOUT_INCREMENTAL):
+    self.incremental = incremental
+    self.structure: Optional[_Structure] = None
+    self.placement: Optional[_Placement] = None
+    # Ids of the nodes of the last tree, by their keys.
+    self.index: Dict[str, int] = dict()
+    # Elements of the last graph, by everything they are made of.
+    self.nodes: Dict[Tuple, elements.Node] = dict()
+    self.edges: Dict[Tuple, elements.Edge] = dict()
+
+  def layout(self, tree: GameTree) -> elements.Graph:
+    """
+    Lay out the tree and make its graph elements.
+
+    For a DAG (merged transpositions) the tree of the first parents is laid
+    out, and the other edges are drawn straight.
+    """
+    if not tree.num_nodes:
+      return elements.Graph()
+    structure = _Structure.of(tree)
+    if not self.incremental:
+      placement = _place(tree, structure)
+    elif structure == self.structure:
+      placement = self.placement
+    else:
+      placement = _place(tree, structure, incremental=True,
+                         last=self.placement, last_index=self.index)
+    nodes = self._make_nodes(tree, structure, placement)
+    edges = self._make_edges(tree, structure, placement, nodes)
+    edges.extend(_infoset_edges(tree, nodes, structure.players, placement.x,
+                                placement.y, placement.height))
+    if self.incremental:
+      self.structure = structure
+      self.placement = placement
+      self.index = tree.index
+    return elements.Graph(placement.graph_width, placement.graph_height, (),
+                          nodes, edges)
+
+  def _make_nodes(self, tree: GameTree, structure: _Structure,
+      placement: _Placement) -> List[elements.Node]:
+    x, y = placement.x, placement.y
+    w, h = placement.width, placement.height
+    flags = tree.node_flags[:tree.num_nodes].tolist()
+    last_nodes = self.nodes
+    made = dict()
+    nodes = []
+    for node in range(tree.num_nodes):
+      color, linewidth, style = _node_pen_attrs(
+          structure.players[node], structure.terminals[node], flags[node])
+      label = structure.node_labels[node]
+      look = (node, x[node], y[node], w[node], h[node],
+              placement.node_shapes[node], color, linewidth, style, label)
+      element = last_nodes.get(look)
+      if element is None:
+        shapes = _node_shapes(placement.node_shapes[node],
+                              _pen(color, linewidth, style),
+                              x[node], y[node], w[node], h[node], label)
+        element = elements.Node(str(node).encode(), x[node], y[node],
+                                w[node], h[node], shapes)
+      made[look] = element
+      nodes.append(element)
+    if self.incremental:
+      self.nodes = made
+    return nodes
+
+  def _make_edges(self, tree: GameTree, structure: _Structure,
+      placement: _Placement, nodes: List[elements.Node]) -> List[elements.Edge]:
+    x, y, h = placement.x, placement.y, placement.height
+    depths = tree.node_depth[:tree.num_nodes].tolist()
+    edge_highlight = tree.edge_highlight[:tree.num_edges].tolist()
+    highlight_width = cfg.PLOT_HIGHLIGHT_PENWIDTH
+    last_edges = self.edges
+    made = dict()
+    edges = []
+    for edge, (src, dst) in enumerate(zip(structure.srcs, structure.dsts)):
+      color = cfg.PLAYER_COLORS.get(structure.players[src], "black")
+      linewidth = highlight_width if edge_highlight[edge] else 1.
+      label = structure.edge_labels[edge]
+      in_tree = placement.tree_edge[dst] == edge
+      src_bottom = y[src] + h[src] / 2
+      dst_top = y[dst] - h[dst] / 2
+      if in_tree:
+        # Down from the parent, along the level to the child and down to it.
+        bus = placement.bus_y[depths[dst]]
+        points = [(x[src], src_bottom), (x[src], bus),
+                  (x[dst], bus), (x[dst], dst_top)]
+      else:
+        points = [(x[src], src_bottom), (x[dst], dst_top)]
+      # The element refers to its nodes, so it is reused only with them.
+      look = (nodes[src], nodes[dst], tuple(points), color, linewidth, label)
+      element = last_edges.get(look)
+      if element is None:
+        pen = _pen(color, linewidth)
+        (x1, y1), (x2, y2) = points[-2:]
+        shapes = [shape.LineShape(pen, points)]
+        shapes.extend(_arrow_shapes(pen, x2, y2, x2 - x1, y2 - y1))
+        if label:
+          if in_tree:
+            shapes.extend(_text_shapes(label.split("\n"), x2 + LABEL_GAP,
+                                       points[1][1] + _line_height() - 2,
+                                       shape.TextShape.LEFT))
+          else:
+            shapes.extend(_text_shapes(label.split("\n"), (x1 + x2) / 2,
+                                       (y1 + y2) / 2, shape.TextShape.CENTER))
+        element = elements.Edge(nodes[src], nodes[dst], points, shapes)
+      made[look] = element
+      edges.append(element)
+    if self.incremental:
+      self.edges = made
+    return edges
+
+
+def _infoset_edges(tree: GameTree, nodes: List[elements.Node],
+    players: List[int], x: List[float], y: List[float],
+    h: List[float]) -> List[elements.Edge]:
+  """Connect the nodes of each information set in a chain of arcs."""
+  infosets = tree.node_infoset[:tree.num_nodes].tolist()
+  last_member = dict()
+  edges = []
+  for node, infoset in enumerate(infosets):
+    if not infoset:
+      continue
+    previous = last_member.get(infoset)
+    last_member[infoset] = node
+    if previous is None:
+      continue
+    pen = _pen(cfg.PLAYER_COLORS.get(players[node], "black"),
+               style=cfg.PLOT_INFOSET_STYLE)
+    start = (x[previous], y[previous] + h[previous] / 2)
+    end = (x[node], y[node] + h[node] / 2)
+    bow = min(RANK_SEP, abs(end[0] - start[0]) / 4)
+    points = [start, (start[0], start[1] + bow), (end[0], end[1] + bow), end]
+    edges.append(elements.Edge(nodes[previous], nodes[node], points,
+                               [shape.BezierShape(pen, points)]))
+  return edges
+
+
+# Layouts of the subtrees laid out in this (worker) process.
+_subtree_cache: Optional[LayoutCache] = None
+
+
+def _layout_subtrees(subtrees: List[GameTree], layout: str,
+    deadline: Optional[float],
+    cancelled: Optional[Callable[[], bool]] = None) \
+    -> List[Optional[elements.Graph]]:
+  """
+  Lay out parts of the tree for `split_layout`, runs in a worker process.
+
+  :param deadline: Give up on graphviz at this time (from `time.time`),
+                   None for no limit.
+  :param cancelled: Stop with `concurrent.futures.CancelledError` once this
+                    returns True, when not in a worker process.
+  :return: The graphs, None for the parts that were not laid out in time.
+  """
+  global _subtree_cache
+  if layout != "tidy" and _subtree_cache is None:
+    _subtree_cache = LayoutCache(cfg.LAYOUT_CACHE_DIR,
+                                 cfg.LAYOUT_CACHE_MAX_BYTES,
+                                 cfg.LAYOUT_CACHE_MEMORY_ENTRIES)
+  graphs = []
+  for subtree in subtrees:
+    if cancelled is not None and cancelled():
+      raise concurrent.futures.CancelledError()
+    if layout == "tidy":
+      graphs.append(TreeLayout(incremental=False).layout(subtree))
+      continue
+    timeout = None
+    if deadline is not None:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        graphs.append(None)
+        continue
+    try:
+      graphs.append(layout_graph(subtree.to_string().encode(),
+                                 cache=_subtree_cache, timeout=timeout,
+                                 cancelled=cancelled))
+    except subprocess.TimeoutExpired:
+      graphs.append(None)
+  return graphs
+
+
+def split_layout(tree: GameTree, layout: str = cfg.LAYOUT,
+    split_depth: int = cfg.LAYOUT_SPLIT_DEPTH,
+    workers: int = cfg.TREE_WORKERS,
+    cancelled: Optional[Callable[[], bool]] = None) \
+    -> Optional[elements.Graph]:
+  """
+  Lay out a large tree in parts: the subtrees below `split_depth` are laid
+  out in worker processes (with graphviz or the tidy tree layout), and put
+  side by side under the nodes above them.
+
+  :param cancelled: Stop with `concurrent.futures.CancelledError` once this
+                    returns True.
+  :return: The graph, or None if the tree can't be split, for example
+           a DAG of merged transpositions.
+  """
+  n = tree.num_nodes
+  parents = tree.node_parent[:n]
+  depths = tree.node_depth[:n]
+  srcs = tree.edge_src[:tree.num_edges]
+  dsts = tree.edge_dst[:tree.num_edges]
+  if (tree.num_edges != np.count_nonzero(parents >= 0)
+      or np.any(parents[dsts] != srcs) or depths.max() <= split_depth):
+    return None
+
+  # The parts: subtrees at the split depth, and leaves above it.
+  has_children = np.zeros(n, dtype=np.bool_)
+  has_children[parents[parents >= 0]] = True
+  above = depths < split_depth
+  is_part_root = (depths == split_depth) | (above & ~has_children)
+  # Number the parts from left to right (in the pre-order of the nodes
+  # above), so that the edges above them don't cross.
+  children = dict()
+  for node in np.flatnonzero(above & has_children).tolist()[::-1]:
+    children[node] = []
+  for node in np.flatnonzero(depths <= split_depth).tolist():
+    if parents[node] >= 0:
+      children[int(parents[node])].append(node)
+  part_of = np.full(n, -1, dtype=np.int64)
+  part_roots = []
+  stack = np.flatnonzero(parents < 0).tolist()[::-1]
+  while stack:
+    node = stack.pop()
+    if is_part_root[node]:
+      part_of[node] = len(part_roots)
+      part_roots.append(node)
+    else:
+      stack.extend(children[node][::-1])
+  for depth in range(split_depth + 1, int(depths.max()) + 1):
+    level = np.flatnonzero(depths == depth)
+    part_of[level] = part_of[parents[level]]
+
+  # Nodes and edges of each part, in increasing order.
+  num_parts = len(part_roots)
+  by_part = np.argsort(part_of, kind="stable")
+  starts = np.searchsorted(part_of[by_part], np.arange(num_parts + 1))
+  inner_edges = np.flatnonzero((part_of[dsts] >= 0) & ~is_part_root[dsts])
+  edge_parts = part_of[dsts[inner_edges]]
+  edges_by_part = inner_edges[np.argsort(edge_parts, kind="stable")]
+  edge_starts = np.searchsorted(np.sort(edge_parts), np.arange(num_parts + 1))
+  part_nodes = [by_part[starts[i]:starts[i + 1]] for i in range(num_parts)]
+  subtrees = []
+  for i in range(num_parts):
+    subtree = tree.extract(part_nodes[i],
+                           edges_by_part[edge_starts[i]:edge_starts[i + 1]])
+    # Information sets span the parts, they are connected below.
+    subtree.node_infoset[:subtree.num_nodes] = 0
+    subtrees.append(subtree)
+
+  # All the parts share one deadline, the parts not laid out by then get
+  # the tidy layout.
+  deadline = None
+  if layout != "tidy" and cfg.LAYOUT_TIMEOUT:
+    deadline = time.time() + cfg.LAYOUT_TIMEOUT
+  if workers > 1 and num_parts > 1:
+    chunksize = max(1, num_parts // (4 * workers))
+    chunks = [subtrees[i:i + chunksize]
+              for i in range(0, num_parts, chunksize)]
+    executor, futures = submit_all(
+        workers, _layout_subtrees,
+        [(chunk, layout, deadline) for chunk in chunks])
+    pending = futures
+    while pending and (deadline is None or time.time() < deadline):
+      wait = None if deadline is None else deadline - time.time()
+      if cancelled is not None:
+        wait = CANCEL_CHECK_INTERVAL if wait is None \
+          else min(wait, CANCEL_CHECK_INTERVAL)
+      _, pending = concurrent.futures.wait(pending, wait)
+      if cancelled is not None and cancelled():
+        for future in futures:
+          future.cancel()
+        raise concurrent.futures.CancelledError()
+    graphs = []
+    for chunk, future in zip(chunks, futures):
+      if not future.done():
+        # A running chunk stops at the deadline too.
+        future.cancel()
+        graphs.extend([None] * len(chunk))
+        continue
+      try:
+        graphs.extend(future.result())
+      except BrokenProcessPool:
+        # A worker died, e.g. graphviz ran out of memory.
+        discard_executor(executor)
+        graphs.extend([None] * len(chunk))
+  else:
+    graphs = _layout_subtrees(subtrees, layout, deadline, cancelled)
+  for i, graph in enumerate(graphs):
+    if graph is None:
+      if cancelled is not None and cancelled():
+        raise concurrent.futures.CancelledError()
+      graphs[i] = TreeLayout(incremental=False).layout(subtrees[i])
+      graphs[i].fast_layout = layout != "tidy"
+  return _pack(tree, part_nodes, graphs, split_depth)
+
+
+def _pack(tree: GameTree, part_nodes: List[np.ndarray],
+    graphs: List[elements.Graph], split_depth: int) -> elements.Graph:
+  """Put the laid out parts side by side, and the nodes above over them."""
+  n = tree.num_nodes
+  labels = tree.labels
+  parents = tree.node_parent[:n].tolist()
+  depths = tree.node_depth[:n].tolist()
+  players = tree.node_player[:n].tolist()
+  terminals = tree.node_terminal[:n].tolist()
+  flags = tree.node_flags[:n].tolist()
+  nodes: List[Optional[elements.Node]] = [None] * n
+  part_elements = []
+  for ids, graph in zip(part_nodes, graphs):
+    ids = ids.tolist()
+    graph_nodes = {int(node.id): node for node in graph.nodes}
+    part_elements.append((graph_nodes[0], graph))
+    for local, node in graph_nodes.items():
+      node.id = str(ids[local]).encode()
+      nodes[ids[local]] = node
+
+  # Sizes of the nodes above the parts.
+  above = [node for node in range(n) if nodes[node] is None]
+  sizes = dict()
+  node_shapes = dict()
+  for node in above:
+    attrs = GameTree._node_class_attrs(players[node], terminals[node])
+    node_shapes[node] = attrs["shape"]
+    sizes[node] = _node_size(attrs["shape"], attrs["width"], attrs["height"],
+                             labels[tree.node_label[node]])
+
+  # Levels down to the split depth, with room for the edge labels.
+  edge_lines = [labels[label].split("\n")
+                for label in tree.edge_label[:tree.num_edges].tolist()]
+  srcs = tree.edge_src[:tree.num_edges].tolist()
+  dsts = tree.edge_dst[:tree.num_edges].tolist()
+  level_height = [0.] * (split_depth + 1)
+  level_lines = [0] * (split_depth + 1)
+  for node in above:
+    level_height[depths[node]] = max(level_height[depths[node]],
+                                     sizes[node][1])
+  for root, _ in part_elements:
+    depth = depths[int(root.id)]
+    level_height[depth] = max(level_height[depth], root.y2 - root.y1)
+  upper_edges = [edge for edge, dst in enumerate(dsts)
+                 if depths[dst] <= split_depth]
+  for edge in upper_edges:
+    depth = depths[dsts[edge]]
+    level_lines[depth] = max(level_lines[depth], len(edge_lines[edge]))
+  level_y = []
+  top = NODE_SEP / 2
+  for depth in range(split_depth + 1):
+    if depth:
+      top += 2 * RANK_SEP + level_lines[depth] * _line_height()
+    level_y.append(top + level_height[depth] / 2)
+    top += level_height[depth]
+
+  # The parts side by side.
+  x = [0.] * n
+  left = NODE_SEP / 2
+  graph_height = 0.
+  fast_layout = False
+  for root, graph in part_elements:
+    dx = left
+    dy = level_y[depths[int(root.id)]] - root.y
+    for node in graph.nodes:
+      node.translate(dx, dy)
+      x[int(node.id)] = node.x
+    for edge in graph.edges:
+      edge.translate(dx, dy)
+    left += graph.width + NODE_SEP
+    graph_height = max(graph_height, graph.height + dy)
+    fast_layout |= graph.fast_layout
+
+  # The nodes above are centered over their children.
+  children_x = dict()
+  for node in range(n - 1, -1, -1):
+    if nodes[node] is None:
+      x[node] = sum(children_x[node]) / 2
+    parent = parents[node]
+    if parent >= 0 and nodes[parent] is None:
+      low, high = children_x.get(parent, (x[node], x[node]))
+      children_x[parent] = (min(low, x[node]), max(high, x[node]))
+  for node in above:
+    w, h = sizes[node]
+    color, linewidth, style = _node_pen_attrs(players[node], terminals[node],
+                                              flags[node])
+    y = level_y[depths[node]]
+    label = labels[tree.node_label[node]]
+    shapes = _node_shapes(node_shapes[node], _pen(color, linewidth, style),
+                          x[node], y, w, h, label)
+    nodes[node] = elements.Node(str(node).encode(), x[node], y, w, h, shapes)
+
+  edges = []
+  edge_highlight = tree.edge_highlight[:tree.num_edges].tolist()
+  for edge in upper_edges:
+    src, dst = nodes[srcs[edge]], nodes[dsts[edge]]
+    color = cfg.PLAYER_COLORS.get(players[srcs[edge]], "black")
+    linewidth = cfg.PLOT_HIGHLIGHT_PENWIDTH if edge_highlight[edge] else 1.
+    pen = _pen(color, linewidth)
+    points = [(src.x, src.y2), (dst.x, dst.y1)]
+    shapes = [shape.LineShape(pen, points)]
+    shapes.extend(_arrow_shapes(pen, dst.x, dst.y1, dst.x - src.x,
+                                dst.y1 - src.y2))
+    if edge_lines[edge] != [""]:
+      shapes.extend(_text_shapes(edge_lines[edge], (src.x + dst.x) / 2,
+                                 (src.y2 + dst.y1) / 2, shape.TextShape.CENTER))
+    edges.append(elements.Edge(src, dst, points, shapes))
+  for _, graph in part_elements:
+    edges.extend(graph.edges)
+
+  x = [node.x for node in nodes]
+  y = [node.y for node in nodes]
+  h = [node.y2 - node.y1 for node in nodes]
+  edges.extend(_infoset_edges(tree, nodes, players, x, y, h))
+  graph = elements.Graph(left - NODE_SEP / 2, graph_height, (), nodes, edges)
+  graph.fast_layout = fast_layout
+  return graph
@@ -1,169 +1,650 @@
-import pygraphviz
+import collections
+import concurrent.futures
+import contextlib
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
 import pyspiel
-import itertools
+from open_spiel.python.observation import make_observation
+
 import spielviz.config as cfg
-from spielviz.logic.state_history import state_from_history, state_undo_n_moves
+from spielviz.logic import traversal
+from spielviz.logic.expansion_cache import ExpandedChild, ExpansionCache
+from spielviz.logic.game_tree import GameTree
+from spielviz.logic.state_history import state_from_history, \
+  state_undo_n_moves
+from spielviz.logic.workers import discard_executor, result, submit_all
+
+
+# Suffix of the keys of nodes that stand for collapsed children.
+COLLAPSED_SUFFIX = " ..."
+
+
+class TreeNode:
+  """
+  Node of the game tree whose `pyspiel.State` is created only on demand,
+  by applying the actions to the state of its parent.
+  """
+
+  __slots__ = ("key", "history_len", "terminal", "_parent", "_actions",
+               "_state")
+
+  def __init__(self, key: str, history_len: int, terminal: bool,
+      parent: Optional["TreeNode"] = None,
+      actions: Optional[List[int]] = None,
+      state: Optional[pyspiel.State] = None):
+    assert state is not None or parent is not None
+    self.key = key
+    self.history_len = history_len
+    self.terminal = terminal
+    self._parent = parent
+    self._actions = actions
+    self._state = state
 
+  @staticmethod
+  def from_state(state: pyspiel.State) -> "TreeNode":
+    return TreeNode(GameTreeViz.state_to_str(state), len(state.history()),
+                    state.is_terminal(), state=state)
 
-class GameTreeViz(pygraphviz.AGraph):
-  """Builds `pygraphviz.AGraph` of the game tree."""
+  @property
+  def state(self) -> pyspiel.State:
+    if self._state is None:
+      state = self._parent.state.clone()
+      if state.is_simultaneous_node():
+        state.apply_actions(self._actions)
+      else:
+        state.apply_action(self._actions[0])
+      self._state = state
+      self._parent = None
+    return self._state
+
+  @contextlib.contextmanager
+  def walked_into(self, in_place: bool):
+    """
+    Within the block, the node uses the state of its parent with its actions
+    applied in place, instead of a copy of it.
+    """
+    if not in_place or self._state is not None \
+        or self._parent.state.is_simultaneous_node():
+      yield
+      return
+
+    state = self._parent.state
+    player = state.current_player()
+    state.apply_action(self._actions[0])
+    self._state = state
+    try:
+      yield
+    finally:
+      self._state = None
+      state.undo_action(player, self._actions[0])
+
+
+class GameTreeViz:
+  """Builds `GameTree` of the game tree, which is written as DOT."""
 
   def __init__(self, state: pyspiel.State = None,
       full_tree: bool = False,
       lookahead: int = 1,
-      lookbehind: int = 1):
-
-    super(GameTreeViz, self).__init__(directed=True)
+      lookbehind: int = 1,
+      max_nodes: int = cfg.TREE_MAX_NODES,
+      expansion: str = cfg.TREE_EXPANSION,
+      transpositions: bool = cfg.TREE_TRANSPOSITIONS,
+      cache: Optional[ExpansionCache] = None,
+      workers: int = cfg.TREE_WORKERS,
+      top_k: int = cfg.TREE_TOP_K,
+      max_joint_actions: int = cfg.TREE_MAX_JOINT_ACTIONS,
+      expanded: Optional[Set[str]] = None,
+      infosets: bool = cfg.TREE_INFOSETS,
+      infoset_player: Optional[int] = None):
+    """
+    :param top_k: Show at most this many children of a node, the rest is
+                  collapsed into a single node. Use 0 to show all children.
+    :param max_joint_actions: The same as `top_k`, for simultaneous nodes.
+    :param expanded: Keys of nodes whose children are never collapsed.
+    :param infosets: Connect the nodes of the same information set.
+    :param infoset_player: Show only the information sets of this player,
+                           None for all the players.
+    """
     assert lookbehind >= 0
     assert lookahead >= 0
+    assert top_k >= 0
+    assert max_joint_actions >= 0
+    assert max_nodes > 0
+    assert expansion in ("breadth_first", "depth_first")
     self.state = state
     self.game = state.get_game()
     self.full_tree = full_tree
     self.lookahead = lookahead
     self.lookbehind = lookbehind
+    self.max_nodes = max_nodes
+    self.expansion = expansion
+    self.transpositions = transpositions
+    self.workers = workers
+    self.top_k = top_k
+    self.max_joint_actions = max_joint_actions
+    self.expanded = expanded if expanded is not None else set()
+    self.infosets = infosets
+    self.infoset_player = infoset_player
+    self.observation = None
+    if infosets:
+      self.observation = self._make_infoset_observation(self.game)
+    self.cache = cache
+    if self.cache is not None:
+      self.cache.bind(self.game)
+    # Walk the children with apply_action / undo_action instead of cloning.
+    self.in_place = traversal.supports_undo(self.game)
+    self.tree = GameTree()
+    # Nodes whose children were not expanded because of the node budget.
+    self.truncated: List[str] = []
+    # Maps state identity to the key of the node that represents it,
+    # if we merge transpositions.
+    self.representatives: Dict[str, str] = dict()
+    # Number of collapsed children of nodes that were expanded, but whose
+    # collapsed node was not added yet.
+    self.num_collapsed: Dict[str, int] = dict()
+    # Stops the build once it returns True.
+    self.cancelled: Optional[Callable[[], bool]] = None
+
+  def build_tree(self, cancelled: Optional[Callable[[], bool]] = None):
+    """
+    :param cancelled: Checked while the tree is built, the build stops with
+                      `concurrent.futures.CancelledError` once it returns
+                      True.
+    """
+    self.cancelled = cancelled
+    if self.transpositions:
+      # The nodes on the trajectory to the current state must represent
+      # their positions, so that the trajectory and the current state can be
+      # highlighted no matter which move order reaches them first.
+      self._add_representatives(self.state)
 
-  def build_tree(self):
     if self.full_tree:
-      yield from self._build_full_tree(self.game.new_initial_state(),
-                                       self.state)
+      root = TreeNode.from_state(self.game.new_initial_state())
+      self._add_root(root)
+      if self._use_workers():
+        self._build_in_workers(root, self.state.history())
+      else:
+        self._build_expansion(root, None, self.state.history())
     else:
+      # The current state is walked in place, so make a private copy.
+      current = TreeNode.from_state(self.state.clone())
       if self.lookbehind:
         start_from = state_undo_n_moves(self.state, self.lookbehind)
-        self.add_node(self.state_to_str(start_from),
-                      **self._node_decorator(start_from))
-        yield from self._build_lookbehind(start_from, self.state)
-      yield from self._build_lookahead(self.state, 0, self.lookahead)
+        root = TreeNode.from_state(start_from)
+        self._add_root(root)
+        self._build_lookbehind(root, self.state.history())
+      else:
+        self._add_root(current)
+      self._build_expansion(current, self.lookahead)
+
+    key = self.state_to_str(self.state)
+    if not self.tree.has_node(key):
+      self._add_root(TreeNode.from_state(self.state))
+    self.tree.set_flag(self.tree.index[key], GameTree.HIGHLIGHT)
 
-    self.add_node(self.state_to_str(self.state),
-                  **self._node_decorator(self.state, highlight_node=True))
-    yield self.state
+  @property
+  def num_nodes(self) -> int:
+    return self.tree.num_nodes
 
-  def state_to_str(self, state: pyspiel.State):
-    # AGraph nodes can't have empty string == None as a key, thus we prepend " "
+  def to_string(self) -> str:
+    return self.tree.to_string()
+
+  @staticmethod
+  def state_to_str(state: pyspiel.State):
+    # Graphviz nodes can't have empty string == None as a key,
+    # thus we prepend " "
     return " " + state.history_str()
 
-  def _children_generator(self, state: pyspiel.State):
-    if state.is_player_node() or state.is_chance_node():
-      for action in state.legal_actions():
-        child = state.child(action)
-        yield child, [action]
-    elif state.is_simultaneous_node():
-      player_actions = [state.legal_actions(p)
-                        for p in range(state.num_players())]
-      for actions in itertools.product(*player_actions):
-        child = state.clone()
-        child.apply_actions(actions)
-        yield child, list(actions)
-    elif state.is_terminal():
+  @staticmethod
+  def collapsed_key(key: str) -> str:
+    """Key of the node that stands for the collapsed children of a node."""
+    return key + COLLAPSED_SUFFIX
+
+  @staticmethod
+  def is_collapsed_key(key: str) -> bool:
+    return key.endswith(COLLAPSED_SUFFIX)
+
+  @staticmethod
+  def state_identity(state: pyspiel.State) -> str:
+    """Identifies the game position regardless of the move order."""
+    return f"{state.current_player()} {state}"
+
+  def _add_representatives(self, state: pyspiel.State):
+    rollout = self.game.new_initial_state()
+    history = state.history()
+    num_players = self.game.num_players()
+    i = 0
+    while True:
+      self.representatives.setdefault(self.state_identity(rollout),
+                                      self.state_to_str(rollout))
+      if i >= len(history):
+        break
+      if rollout.is_simultaneous_node():
+        rollout.apply_actions(history[i:i + num_players])
+        i += num_players
+      else:
+        rollout.apply_action(history[i])
+        i += 1
+
+  @staticmethod
+  def _make_infoset_observation(game: pyspiel.Game):
+    observation_type = pyspiel.IIGObservationType(
+        public_info=True, perfect_recall=True,
+        private_info=pyspiel.PrivateInfoType.SINGLE_PLAYER)
+    try:
+      return make_observation(game, observation_type)
+    except (RuntimeError, pyspiel.SpielError) as e:
+      # Fall back to State.information_state_string
+      logging.debug(f"Could not make infoset observation: {e}")
+      return None
+
+  def infoset(self, state: pyspiel.State) -> str:
+    """
+    Information set of the acting player, as a string that is unique within
+    the game tree. Empty if no player acts.
+    """
+    player = state.current_player()
+    if player < 0:
+      return ""
+    if self.observation is not None:
+      return f"{player} {self.observation.string_from(state, player)}"
+    return f"{player} {state.information_state_string(player)}"
+
+  def _describe_child(self, child: pyspiel.State, actions: List[int],
+      edge_label: str) -> ExpandedChild:
+    identity = self.state_identity(child) if self.transpositions else None
+    infoset = self.infoset(child) if self.infosets else None
+    return ExpandedChild(actions, self.state_to_str(child),
+                         child.current_player(), child.is_terminal(),
+                         self._node_label(child), edge_label, identity,
+                         infoset)
+
+  def _expand(self, node: TreeNode, arrive_hist: Optional[List[int]] = None) \
+      -> List[Tuple[TreeNode, ExpandedChild]]:
+    """
+    Find the children of the node, preferably in the cache.
+
+    :param arrive_hist: If the node lies on the trajectory to this history,
+                        the child on the trajectory is never collapsed.
+    """
+    children = None
+    if self.cache is not None:
+      children = self.cache.get(node.key)
+    if children is not None and self._max_shown(node, children) is not None:
+      children = None
+
+    if children is None:
+      state = node.state
+      max_shown = self._max_shown(node)
+      collapses = max_shown is not None
+      if collapses:
+        actions_list = self._top_actions(node, max_shown, arrive_hist)
+        self.num_collapsed[node.key] = \
+          traversal.num_children(state) - len(actions_list)
+      else:
+        actions_list = traversal.joint_actions(state)
+      # Edges must be described before the state is changed in place.
+      edge_labels = self._edge_labels(state, actions_list)
+      children, states = [], []
+      for (child, actions), edge_label in zip(
+          traversal.children(state, self.in_place, actions_list),
+          edge_labels):
+        children.append(self._describe_child(child, actions, edge_label))
+        # Children walked in place are created later, only if we need them.
+        states.append(None if child is state else child)
+      # Only complete expansions are cached.
+      if self.cache is not None and not collapses:
+        self.cache.put(node.key, children)
+    else:
+      states = [None] * len(children)
+
+    history_len = node.history_len
+    expanded = [(TreeNode(child.key, history_len + len(child.actions),
+                          child.terminal, parent=node, actions=child.actions,
+                          state=state), child)
+                for child, state in zip(children, states)]
+    if self.transpositions:
+      for child_node, child in expanded:
+        if child.identity is None:
+          child.identity = self.state_identity(child_node.state)
+    if self.infosets:
+      for child_node, child in expanded:
+        if child.infoset is None:
+          child.infoset = self.infoset(child_node.state)
+    return expanded
+
+  def _max_shown(self, node: TreeNode,
+      children: Optional[List[ExpandedChild]] = None) -> Optional[int]:
+    """
+    How many children of the node are shown, if some of them are collapsed.
+
+    :param children: Children of the node from the cache, so that its state
+                     is not needed.
+    :return: None if all the children are shown.
+    """
+    if node.key in self.expanded:
+      return None
+    if children is not None:
+      simultaneous = bool(children) and len(children[0].actions) > 1
+      num_children = len(children)
+    else:
+      simultaneous = node.state.is_simultaneous_node()
+      num_children = traversal.num_children(node.state)
+    max_shown = traversal.max_shown_children(simultaneous, self.top_k,
+                                             self.max_joint_actions)
+    # Collapsing a single child would not save anything.
+    if max_shown and num_children > max_shown + 1:
+      return max_shown
+    return None
+
+  def _top_actions(self, node: TreeNode, max_shown: int,
+      arrive_hist: Optional[List[int]]) -> List[List[int]]:
+    """
+    Choose the children that are shown: the most probable chance outcomes,
+    or the first (joint) actions, and the child on the trajectory.
+    """
+    state = node.state
+    if state.is_chance_node():
+      outcomes = sorted(state.chance_outcomes(),
+                        key=lambda outcome: -outcome[1])
+      shown = [[action] for action, _ in outcomes[:max_shown]]
+    else:
+      shown = traversal.joint_actions(state, limit=max_shown)
+    if arrive_hist is not None:
+      len_sh = node.history_len
+      trajectory = arrive_hist[len_sh:len_sh + len(shown[0])]
+      if trajectory not in shown and traversal.is_legal(state, trajectory):
+        shown.append(trajectory)
+    return shown
+
+  def _add_collapsed(self, node: TreeNode):
+    """Add the node that stands for the collapsed children, if any."""
+    num_collapsed = self.num_collapsed.pop(node.key, 0)
+    if not num_collapsed:
       return
+    tree = self.tree
+    src = tree.index[node.key]
+    dst = tree.add_node(self.collapsed_key(node.key),
+                        int(tree.node_player[src]), False,
+                        f"{num_collapsed} more", parent=src)
+    tree.set_flag(dst, GameTree.COLLAPSED)
+    tree.add_edge(src, dst)
+
+  def _trajectory_child(self, node: TreeNode, arrive_hist: List[int]) \
+      -> Tuple[TreeNode, ExpandedChild]:
+    state = node.state
+    len_sh = node.history_len
+    if state.is_simultaneous_node():
+      actions = arrive_hist[len_sh:len_sh + state.num_players()]
+      child = state.clone()
+      child.apply_actions(actions)
     else:
-      raise RuntimeError(f"Unhandled type of state! {str(state)}")
+      actions = arrive_hist[len_sh:len_sh + 1]
+      child = state.child(actions[0])
+    edge_label, = self._edge_labels(state, [actions])
+    return (TreeNode.from_state(child),
+            self._describe_child(child, actions, edge_label))
 
-  def _build_full_tree(self, start_from_state, arrive_to_state):
-    start_hist = start_from_state.history()
-    arrive_hist = arrive_to_state.history()
-    state_lies_on_trajectory = (
-        len(start_hist) < len(arrive_hist)
-        and arrive_hist[:len(start_hist)] == start_hist)
-    state_str = self.state_to_str(start_from_state)
-    len_sh = len(start_hist)
+  def _add_root(self, node: TreeNode):
+    if self.transpositions:
+      self.representatives.setdefault(self.state_identity(node.state),
+                                      node.key)
+    state = node.state
+    player = state.current_player()
+    infoset = self.infoset(state) if self.infosets else ""
+    self.tree.add_node(node.key, player, state.is_terminal(),
+                       self._node_label(state),
+                       infoset=self._shown_infoset(player, infoset))
 
-    for child, actions in self._children_generator(start_from_state):
-      child_str = self.state_to_str(child)
+  def _shown_infoset(self, player: int, infoset: Optional[str]) -> str:
+    if not infoset or (self.infoset_player is not None
+                       and player != self.infoset_player):
+      return ""
+    return infoset
 
-      edge_lies_on_trajectory = (
-          state_lies_on_trajectory
-          and arrive_hist[len_sh:len_sh+len(actions)] == actions)
+  def _add_child(self, parent: TreeNode, child: ExpandedChild,
+      highlight_edge: bool = False) -> bool:
+    """
+    Add the child and the edge leading to it.
 
-      self.add_node(child_str, **self._node_decorator(child))
-      self.add_edge(state_str, child_str, **self._edge_decorator(
-          start_from_state, actions, highlight_edge=edge_lies_on_trajectory))
+    :return: Should the child be expanded? It should not be if the child
+             is a transposition of a node that is expanded elsewhere.
+    """
+    key = child.key
+    if self.transpositions:
+      key = self.representatives.setdefault(child.identity, key)
 
-      yield child
-      yield from self._build_full_tree(child, arrive_to_state)
+    tree = self.tree
+    src = tree.index[parent.key]
+    dst = tree.index.get(key)
+    if dst is None:
+      dst = tree.add_node(key, child.player, child.terminal, child.label,
+                          parent=src, action=child.actions[-1],
+                          infoset=self._shown_infoset(child.player,
+                                                      child.infoset))
+    tree.add_edge(src, dst, child.edge_label, highlight_edge)
+    return key == child.key
 
-  def _build_lookbehind(self, start_from_state, arrive_to_state):
-    start_hist = start_from_state.history()
-    arrive_hist = arrive_to_state.history()
-    if start_hist == arrive_hist:
-      return
+  def _fits_budget(self, node: TreeNode) -> bool:
+    children = None
+    if self.cache is not None:
+      children = self.cache.get(node.key)
+    max_shown = self._max_shown(node, children)
+    if max_shown is not None:
+      # The shown children, the child on the trajectory and the collapsed
+      # node.
+      num_children = max_shown + 2
+    elif children is not None:
+      num_children = len(children)
+    else:
+      num_children = traversal.num_children(node.state)
+    return self.num_nodes + num_children <= self.max_nodes
 
-    state_str = self.state_to_str(start_from_state)
-    len_sh = len(start_hist)
-    for child, actions in self._children_generator(start_from_state):
-      child_str = self.state_to_str(child)
+  def _check_cancelled(self):
+    if self.cancelled is not None and self.cancelled():
+      raise concurrent.futures.CancelledError()
 
-      lies_on_trajectory = arrive_hist[len_sh:len_sh+len(actions)] == actions
+  def _mark_truncated(self, node: TreeNode):
+    self.tree.set_flag(self.tree.index[node.key], GameTree.TRUNCATED)
+    self.truncated.append(node.key)
 
-      self.add_node(child_str, **self._node_decorator(child))
-      self.add_edge(state_str, child_str, **self._edge_decorator(
-          start_from_state, actions, highlight_edge=lies_on_trajectory))
+  def _build_expansion(self, root: TreeNode,
+      max_depth: Optional[int], arrive_hist: Optional[List[int]] = None):
+    if self.expansion == "breadth_first":
+      self._build_breadth_first(root, max_depth, arrive_hist)
+    else:
+      on_trajectory = arrive_hist is not None
+      self._build_depth_first(root, 0, max_depth, arrive_hist, on_trajectory)
 
-      yield child
-      if lies_on_trajectory:
-        yield from self._build_lookbehind(child, arrive_to_state)
+  def _build_breadth_first(self, root: TreeNode,
+      max_depth: Optional[int], arrive_hist: Optional[List[int]] = None,
+      split: bool = False) -> List[Tuple[TreeNode, bool]]:
+    """
+    Expand the tree level by level, so that the node budget is spread
+    evenly over the tree. Once a node's children do not fit into the budget,
+    the node and the rest of the frontier are marked as truncated.
 
-  def _build_lookahead(self, state, depth, lookahead):
-    state_str = self.state_to_str(state)
+    :param max_depth: Expand at most this many levels below the root,
+                      None for no limit.
+    :param arrive_hist: Highlight edges that lead to this history.
+    :param split: The nodes at `max_depth` are expanded further by the caller,
+                  so they are truncated as well if the budget runs out.
+    :return: Nodes at `max_depth` that could be expanded further,
+             and whether they lie on the trajectory to the arrive history.
+    """
+    on_trajectory = arrive_hist is not None
+    frontier = collections.deque([(root, 0, on_trajectory)])
+    unexpanded = []
+    while frontier:
+      self._check_cancelled()
+      node, depth, on_trajectory = frontier.popleft()
+      if node.terminal:
+        continue
+      if max_depth is not None and depth >= max_depth:
+        unexpanded.append((node, on_trajectory))
+        continue
+      if not self._fits_budget(node):
+        self._mark_truncated(node)
+        for node, depth, _ in frontier:
+          if not node.terminal and (split or max_depth is None
+                                    or depth < max_depth):
+            self._mark_truncated(node)
+        if split:
+          for node, _ in unexpanded:
+            self._mark_truncated(node)
+        return []
 
-    if state.is_terminal():
+      len_sh = node.history_len
+      for child_node, child in self._expand(
+          node, arrive_hist if on_trajectory else None):
+        actions = child.actions
+        edge_lies_on_trajectory = (
+            on_trajectory
+            and arrive_hist[len_sh:len_sh + len(actions)] == actions)
+        if self._add_child(node, child,
+                           highlight_edge=edge_lies_on_trajectory):
+          frontier.append((child_node, depth + 1, edge_lies_on_trajectory))
+      self._add_collapsed(node)
+    return unexpanded
+
+  def _use_workers(self) -> bool:
+    return (self.workers > 1 and not self.transpositions
+            and self.max_nodes >= cfg.TREE_PARALLEL_MIN_NODES)
+
+  def _build_in_workers(self, root: TreeNode, arrive_hist: List[int]):
+    """
+    Expand the top of the tree up to `cfg.TREE_SPLIT_DEPTH` here, and the
+    subtrees below it in worker processes. The remaining node budget is split
+    evenly among the subtrees.
+    """
+    subtrees = self._build_breadth_first(root, cfg.TREE_SPLIT_DEPTH,
+                                         arrive_hist, split=True)
+    if not subtrees:
       return
-    if depth >= lookahead >= 0:
+    budget = (self.max_nodes - self.num_nodes) // len(subtrees)
+    if budget == 0:
+      for node, _ in subtrees:
+        self._mark_truncated(node)
       return
 
-    for child, actions in self._children_generator(state):
-      child_str = self.state_to_str(child)
-      self.add_node(child_str, **self._node_decorator(child))
-      self.add_edge(state_str, child_str, **self._edge_decorator(state, actions))
-      yield child
-      yield from self._build_lookahead(child, depth + 1, lookahead)
+    game_str = str(self.game)
+    calls = [(game_str, node.state.history(), budget + 1, self.expansion,
+              arrive_hist if on_trajectory else None, self.top_k,
+              self.max_joint_actions, self.expanded, self.infosets,
+              self.infoset_player)
+             for node, on_trajectory in subtrees]
+    executor, futures = submit_all(self.workers, _build_subtree, calls)
+    try:
+      for (node, _), args, future in zip(subtrees, calls, futures):
+        try:
+          subtree, truncated = result(future, self.cancelled)
+        except BrokenProcessPool:
+          # A worker died, expand the subtree here instead.
+          discard_executor(executor)
+          subtree, truncated = _build_subtree(*args)
+        self.tree.merge(subtree, self.tree.index[node.key])
+        self.truncated.extend(truncated)
+    finally:
+      for future in futures:
+        future.cancel()
 
-  def _node_decorator(self, state, highlight_node=False):
-    player = state.current_player()
-    attrs = dict(
-        label="",
-        fontsize=cfg.PLOT_FONTSIZE,
-        width=cfg.PLOT_WIDTH,
-        height=cfg.PLOT_HEIGHT,
-        margin=cfg.PLOT_MARGIN
-    )
+  def _build_depth_first(self, node: TreeNode, depth: int,
+      max_depth: Optional[int], arrive_hist: Optional[List[int]] = None,
+      on_trajectory: bool = False):
+    self._check_cancelled()
+    if node.terminal:
+      return
+    if max_depth is not None and depth >= max_depth:
+      return
+    if not self._fits_budget(node):
+      self._mark_truncated(node)
+      return
 
-    if state.is_terminal():
-      attrs["label"] = ", ".join(map(str, state.returns()))
-      attrs["shape"] = cfg.PLAYER_SHAPES[pyspiel.PlayerId.TERMINAL]
-      attrs["color"] = cfg.PLAYER_COLORS[pyspiel.PlayerId.TERMINAL]
-    elif state.is_chance_node():
-      attrs["width"] = cfg.PLOT_WIDTH / 2.
-      attrs["height"] = cfg.PLOT_HEIGHT / 2.
-      attrs["shape"] = cfg.PLAYER_SHAPES[pyspiel.PlayerId.CHANCE]
-      attrs["color"] = cfg.PLAYER_COLORS[pyspiel.PlayerId.CHANCE]
-    else:
-      attrs["shape"] = cfg.PLAYER_SHAPES.get(player, "square")
-      attrs["color"] = cfg.PLAYER_COLORS.get(player, "black")
+    # All the children are added first, as they were accounted for
+    # in the budget of this node.
+    len_sh = node.history_len
+    expand_next = []
+    for child_node, child in self._expand(
+        node, arrive_hist if on_trajectory else None):
+      actions = child.actions
+      edge_lies_on_trajectory = (
+          on_trajectory
+          and arrive_hist[len_sh:len_sh + len(actions)] == actions)
+      if self._add_child(node, child,
+                         highlight_edge=edge_lies_on_trajectory):
+        expand_next.append((child_node, edge_lies_on_trajectory))
+    self._add_collapsed(node)
 
-    if highlight_node:
-      attrs["penwidth"] = cfg.PLOT_HIGHLIGHT_PENWIDTH
-    return attrs
+    for child_node, edge_lies_on_trajectory in expand_next:
+      with child_node.walked_into(self.in_place):
+        self._build_depth_first(child_node, depth + 1, max_depth, arrive_hist,
+                                edge_lies_on_trajectory)
 
-  def _edge_decorator(self, parent, actions, highlight_edge=False):
+  def _build_lookbehind(self, node: TreeNode, arrive_hist: List[int]):
+    """Expand the nodes on the trajectory to the arrive history."""
+    while node.history_len < len(arrive_hist):
+      self._check_cancelled()
+      # Siblings of the trajectory are shown only if they fit into the budget,
+      # the trajectory itself is always kept so that we reach the current
+      # state.
+      if self._fits_budget(node):
+        children = self._expand(node, arrive_hist)
+      else:
+        self._mark_truncated(node)
+        children = [self._trajectory_child(node, arrive_hist)]
+
+      len_sh = node.history_len
+      next_node = None
+      for child_node, child in children:
+        actions = child.actions
+        lies_on_trajectory = \
+          arrive_hist[len_sh:len_sh + len(actions)] == actions
+        self._add_child(node, child, highlight_edge=lies_on_trajectory)
+        if lies_on_trajectory:
+          next_node = child_node
+      self._add_collapsed(node)
+      node = next_node
+
+  def _node_label(self, state: pyspiel.State) -> str:
+    if state.is_terminal():
+      return ", ".join(map(str, state.returns()))
+    return ""
+
+  def _edge_labels(self, parent: pyspiel.State,
+      actions_list: List[List[int]]) -> List[str]:
     player = parent.current_player()
+    probs = dict(parent.chance_outcomes()) if parent.is_chance_node() else None
+    return [self._edge_label(parent, player, actions, probs)
+            for actions in actions_list]
+
+  def _edge_label(self, parent: pyspiel.State, player: int,
+      actions: List[int], probs: Optional[Dict[int, float]] = None) -> str:
     if len(actions) == 1:
       label = parent.action_to_string(player, actions[0])
     else:
       label = "\n ".join([parent.action_to_string(p, action)
-                         for p, action in enumerate(actions)])
-    if parent.is_chance_node():
+                          for p, action in enumerate(actions)])
+    if probs is not None:
       assert len(actions) == 1
-      prob = [p for action, p in parent.chance_outcomes()
-              if action == actions[0]]
       # todo: format as a note
-      label += f"\n (p={prob[0]:.2f})"
-    attrs = dict(
-        label=" " + label,
-        fontsize=cfg.PLOT_FONTSIZE,
-        arrowsize=cfg.PLOT_ARROWSIZE,
-    )
-    attrs["color"] = cfg.PLAYER_COLORS.get(player, "black")
-    if highlight_edge:
-      attrs["penwidth"] = cfg.PLOT_HIGHLIGHT_PENWIDTH
-    return attrs
+      label += f"\n (p={probs[actions[0]]:.2f})"
+    return label
+
+
+def _build_subtree(game_str: str, history: List[int], max_nodes: int,
+    expansion: str, arrive_hist: Optional[List[int]], top_k: int,
+    max_joint_actions: int, expanded: Set[str], infosets: bool,
+    infoset_player: Optional[int]) -> Tuple[GameTree, List[str]]:
+  """Expand the subtree below the history, runs in a worker process."""
+  game = pyspiel.load_game(game_str)
+  state = state_from_history(game, history)
+  viz = GameTreeViz(state, max_nodes=max_nodes, expansion=expansion,
+                    transpositions=False, workers=1, top_k=top_k,
+                    max_joint_actions=max_joint_actions, expanded=expanded,
+                    infosets=infosets, infoset_player=infoset_player)
+  root = TreeNode.from_state(state)
+  viz._add_root(root)
+  viz._build_expansion(root, None, arrive_hist)
+  return viz.tree, viz.truncated
@@ -0,0 +1,68 @@
+import collections
+from typing import Dict, List, Optional
+
+import pyspiel
+
+
+class ExpandedChild:
+  """Everything needed to draw a child of an expanded node,
+  without the need to keep its `pyspiel.State` around."""
+
+  __slots__ = ("actions", "key", "player", "terminal", "label", "edge_label",
+               "identity", "infoset")
+
+  def __init__(self, actions: List[int], key: str, player: int,
+      terminal: bool, label: str, edge_label: str,
+      identity: Optional[str] = None, infoset: Optional[str] = None):
+    self.actions = actions
+    self.key = key
+    self.player = player
+    self.terminal = terminal
+    self.label = label
+    self.edge_label = edge_label
+    # Identifies the game position regardless of the move order,
+    # filled in only when it is needed to merge transpositions.
+    self.identity = identity
+    # Information set of the acting player ("" if no player acts),
+    # filled in only when information sets are shown.
+    self.infoset = infoset
+
+
+class ExpansionCache:
+  """
+  LRU cache of expanded nodes of a single game, keyed by history.
+
+  When the user navigates within the tree, most of the nodes of the new tree
+  were already expanded for the previous one, so we can draw them without
+  calling `legal_actions`, `child`, `action_to_string` etc. again.
+  """
+
+  def __init__(self, max_size: int):
+    assert max_size >= 0
+    self.max_size = max_size
+    self.game_str: Optional[str] = None
+    self.entries: Dict[str, List[ExpandedChild]] = collections.OrderedDict()
+
+  def bind(self, game: pyspiel.Game):
+    """Use the cache for the given game, dropping entries of other games."""
+    game_str = str(game)
+    if game_str != self.game_str:
+      self.game_str = game_str
+      self.entries.clear()
+
+  def get(self, key: str) -> Optional[List[ExpandedChild]]:
+    children = self.entries.get(key)
+    if children is not None:
+      self.entries.move_to_end(key)
+    return children
+
+  def put(self, key: str, children: List[ExpandedChild]):
+    if self.max_size == 0:
+      return
+    self.entries[key] = children
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_size:
+      self.entries.popitem(last=False)
+
+  def __len__(self):
+    return len(self.entries)
@@ -0,0 +1,363 @@
+import io
+from typing import Dict, List, TextIO
+
+import numpy as np
+import pyspiel
+
+import spielviz.config as cfg
+
+
+def _quote(text: str) -> str:
+  return '"' + text.replace('"', '\\"') + '"'
+
+
+class GameTree:
+  """
+  Compact store of the game tree (or a DAG, if transpositions are merged).
+
+  Nodes and edges live in NumPy arrays indexed by their id, and all labels
+  are interned in a single table. Nodes are also indexed by their key
+  (history string). The tree is written as DOT text directly, with the node
+  ids as DOT node names (`keys` maps them back), and the same arrays can be
+  used by other layout engines.
+  """
+
+  # Node flags.
+  HIGHLIGHT = 1
+  TRUNCATED = 2
+  COLLAPSED = 4
+
+  def __init__(self, capacity: int = 256):
+    self.num_nodes = 0
+    self.num_edges = 0
+    # Node key (history string) of each node, and the reverse index.
+    self.keys: List[str] = []
+    self.index: Dict[str, int] = dict()
+    # Interned labels, the empty label has id 0.
+    self.labels: List[str] = [""]
+    self._label_ids: Dict[str, int] = {"": 0}
+
+    # Parent of the node (-1 for roots) and the action leading from it (the
+    # last one for joint actions). In a DAG this is the first parent only.
+    self.node_parent = np.empty(capacity, dtype=np.int32)
+    self.node_action = np.empty(capacity, dtype=np.int64)
+    # Current player, as given by `pyspiel.State.current_player()`.
+    self.node_player = np.empty(capacity, dtype=np.int16)
+    self.node_depth = np.empty(capacity, dtype=np.int32)
+    self.node_terminal = np.empty(capacity, dtype=np.bool_)
+    self.node_flags = np.empty(capacity, dtype=np.uint8)
+    self.node_label = np.empty(capacity, dtype=np.int32)
+    # Interned information set of the acting player, 0 if not shown.
+    self.node_infoset = np.empty(capacity, dtype=np.int32)
+
+    self.edge_src = np.empty(capacity, dtype=np.int32)
+    self.edge_dst = np.empty(capacity, dtype=np.int32)
+    self.edge_label = np.empty(capacity, dtype=np.int32)
+    self.edge_highlight = np.empty(capacity, dtype=np.bool_)
+
+  _node_arrays = ("node_parent", "node_action", "node_player", "node_depth",
+                  "node_terminal", "node_flags", "node_label", "node_infoset")
+  _edge_arrays = ("edge_src", "edge_dst", "edge_label", "edge_highlight")
+
+  def _grow(self, names, size: int):
+    for name in names:
+      array = getattr(self, name)
+      if len(array) < size:
+        grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+        grown[:len(array)] = array
+        setattr(self, name, grown)
+
+  def intern(self, label: str) -> int:
+    label_id = self._label_ids.get(label)
+    if label_id is None:
+      label_id = len(self.labels)
+      self.labels.append(label)
+      self._label_ids[label] = label_id
+    return label_id
+
+  def add_node(self, key: str, player: int, terminal: bool, label: str = "",
+      parent: int = -1, action: int = -1, infoset: str = "") -> int:
+    assert key not in self.index
+    node = self.num_nodes
+    if node == len(self.node_parent):
+      self._grow(self._node_arrays, node + 1)
+    self.node_parent[node] = parent
+    self.node_action[node] = action
+    self.node_player[node] = player
+    self.node_depth[node] = 0 if parent < 0 else self.node_depth[parent] + 1
+    self.node_terminal[node] = terminal
+    self.node_flags[node] = 0
+    self.node_label[node] = self.intern(label)
+    self.node_infoset[node] = self.intern(infoset)
+    self.keys.append(key)
+    self.index[key] = node
+    self.num_nodes += 1
+    return node
+
+  def add_edge(self, src: int, dst: int, label: str = "",
+      highlight: bool = False) -> int:
+    edge = self.num_edges
+    if edge == len(self.edge_src):
+      self._grow(self._edge_arrays, edge + 1)
+    self.edge_src[edge] = src
+    self.edge_dst[edge] = dst
+    self.edge_label[edge] = self.intern(label)
+    self.edge_highlight[edge] = highlight
+    self.num_edges += 1
+    return edge
+
+  def set_flag(self, node: int, flag: int):
+    self.node_flags[node] |= flag
+
+  def has_node(self, key: str) -> bool:
+    return key in self.index
+
+  def merge(self, subtree: "GameTree", at: int):
+    """
+    Append a subtree whose root (node 0) is the node `at` of this tree,
+    for example a subtree that was expanded in another process.
+    """
+    num_new = subtree.num_nodes - 1
+    first = self.num_nodes
+    self._grow(self._node_arrays, first + num_new)
+    self._grow(self._edge_arrays, self.num_edges + subtree.num_edges)
+
+    # Ids of the subtree nodes and labels in this tree.
+    node_map = np.arange(first - 1, first + num_new, dtype=np.int32)
+    node_map[0] = at
+    label_map = np.array([self.intern(label) for label in subtree.labels],
+                         dtype=np.int32)
+
+    new = slice(first, first + num_new)
+    old = slice(1, subtree.num_nodes)
+    self.node_parent[new] = node_map[subtree.node_parent[old]]
+    self.node_action[new] = subtree.node_action[old]
+    self.node_player[new] = subtree.node_player[old]
+    self.node_depth[new] = subtree.node_depth[old] + self.node_depth[at]
+    self.node_terminal[new] = subtree.node_terminal[old]
+    self.node_flags[new] = subtree.node_flags[old]
+    self.node_label[new] = label_map[subtree.node_label[old]]
+    self.node_infoset[new] = label_map[subtree.node_infoset[old]]
+    self.node_flags[at] |= subtree.node_flags[0]
+    new_keys = subtree.keys[1:]
+    self.keys.extend(new_keys)
+    self.index.update(zip(new_keys, range(first, first + num_new)))
+    self.num_nodes += num_new
+
+    new = slice(self.num_edges, self.num_edges + subtree.num_edges)
+    old = slice(0, subtree.num_edges)
+    self.edge_src[new] = node_map[subtree.edge_src[old]]
+    self.edge_dst[new] = node_map[subtree.edge_dst[old]]
+    self.edge_label[new] = label_map[subtree.edge_label[old]]
+    self.edge_highlight[new] = subtree.edge_highlight[old]
+    self.num_edges += subtree.num_edges
+
+  def extract(self, nodes: np.ndarray, edges: np.ndarray) -> "GameTree":
+    """
+    Copy a part of the tree, for example a subtree to be laid out in another
+    process. The first of the nodes becomes the root (node 0).
+
+    :param nodes: Ids in increasing order, the parents of all but the first
+                  one must be among them.
+    :param edges: Ids of the edges between the nodes.
+    """
+    part = GameTree(capacity=max(len(nodes), len(edges), 1))
+    # Ids of the labels in the part, the empty label stays at 0.
+    used_labels, label_map = np.unique(np.concatenate((
+        [0], self.node_label[nodes], self.node_infoset[nodes],
+        self.edge_label[edges])), return_inverse=True)
+    label_map = label_map.astype(np.int32)
+    num_nodes, num_edges = len(nodes), len(edges)
+    node_labels = label_map[1:1 + num_nodes]
+    node_infosets = label_map[1 + num_nodes:1 + 2 * num_nodes]
+    edge_labels = label_map[1 + 2 * num_nodes:]
+
+    new = slice(0, num_nodes)
+    part.node_parent[new] = np.searchsorted(nodes, self.node_parent[nodes])
+    part.node_parent[0] = -1
+    part.node_action[new] = self.node_action[nodes]
+    part.node_player[new] = self.node_player[nodes]
+    part.node_depth[new] = self.node_depth[nodes] - self.node_depth[nodes[0]]
+    part.node_terminal[new] = self.node_terminal[nodes]
+    part.node_flags[new] = self.node_flags[nodes]
+    part.node_label[new] = node_labels
+    part.node_infoset[new] = node_infosets
+    part.keys = [self.keys[node] for node in nodes.tolist()]
+    part.index = {key: node for node, key in enumerate(part.keys)}
+    part.labels = [self.labels[label] for label in used_labels.tolist()]
+    part._label_ids = {label: i for i, label in enumerate(part.labels)}
+    part.num_nodes = num_nodes
+
+    new = slice(0, num_edges)
+    part.edge_src[new] = np.searchsorted(nodes, self.edge_src[edges])
+    part.edge_dst[new] = np.searchsorted(nodes, self.edge_dst[edges])
+    part.edge_label[new] = edge_labels
+    part.edge_highlight[new] = self.edge_highlight[edges]
+    part.num_edges = num_edges
+    return part
+
+  def __getstate__(self):
+    # Send only the used part of the arrays to other processes,
+    # the indices are rebuilt on the other side.
+    state = self.__dict__.copy()
+    for name in self._node_arrays:
+      state[name] = state[name][:self.num_nodes]
+    for name in self._edge_arrays:
+      state[name] = state[name][:self.num_edges]
+    del state["index"]
+    del state["_label_ids"]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.index = {key: node for node, key in enumerate(self.keys)}
+    self._label_ids = {label: i for i, label in enumerate(self.labels)}
+
+  # ---------------------------------------------------------------------------
+  # DOT output.
+
+  @staticmethod
+  def _shared_node_attrs() -> Dict:
+    return dict(
+        fontsize=cfg.PLOT_FONTSIZE,
+        margin=cfg.PLOT_MARGIN
+    )
+
+  @staticmethod
+  def _shared_edge_attrs() -> Dict:
+    return dict(
+        fontsize=cfg.PLOT_FONTSIZE,
+        arrowsize=cfg.PLOT_ARROWSIZE,
+    )
+
+  @staticmethod
+  def _node_class_attrs(player: int, terminal: bool) -> Dict:
+    # Every class sets all of these, as the defaults stay in effect
+    # until they are overridden by the next class.
+    attrs = dict(width=cfg.PLOT_WIDTH, height=cfg.PLOT_HEIGHT)
+    if terminal:
+      attrs["shape"] = cfg.PLAYER_SHAPES[pyspiel.PlayerId.TERMINAL]
+      attrs["color"] = cfg.PLAYER_COLORS[pyspiel.PlayerId.TERMINAL]
+    elif player == pyspiel.PlayerId.CHANCE:
+      attrs["width"] = cfg.PLOT_WIDTH / 2.
+      attrs["height"] = cfg.PLOT_HEIGHT / 2.
+      attrs["shape"] = cfg.PLAYER_SHAPES[pyspiel.PlayerId.CHANCE]
+      attrs["color"] = cfg.PLAYER_COLORS[pyspiel.PlayerId.CHANCE]
+    else:
+      attrs["shape"] = cfg.PLAYER_SHAPES.get(player, "square")
+      attrs["color"] = cfg.PLAYER_COLORS.get(player, "black")
+    return attrs
+
+  @staticmethod
+  def _edge_class_attrs(player: int) -> Dict:
+    return dict(color=cfg.PLAYER_COLORS.get(player, "black"))
+
+  def _graphviz_tier(self) -> Dict:
+    """Settings for the size of this tree, see GRAPHVIZ_TIERS."""
+    tier = dict()
+    for candidate in cfg.GRAPHVIZ_TIERS:
+      if self.num_nodes >= candidate["min_nodes"]:
+        tier = candidate
+    return tier
+
+  @staticmethod
+  def _format_attrs(attrs: Dict) -> str:
+    return ", ".join(f"{name}={_quote(str(value))}"
+                     for name, value in attrs.items())
+
+  def write_dot(self, out: TextIO):
+    """
+    Stream the tree as DOT text into `out`.
+
+    Attributes shared by a class of elements (player, chance, terminal) are
+    written only as `node [...]` / `edge [...]` defaults whenever the class
+    changes, so that each element carries just its label. The elements keep
+    their order, which the layout depends on.
+
+    Large trees get cheaper layout settings, see GRAPHVIZ_TIERS.
+    """
+    labels = self.labels
+    tier = self._graphviz_tier()
+    graph_attrs = tier.get("graph_attrs")
+    edge_label = tier.get("edge_label", "label")
+    highlight = ", penwidth=" + _quote(str(cfg.PLOT_HIGHLIGHT_PENWIDTH))
+    truncated = ", style=" + _quote(cfg.PLOT_TRUNCATED_STYLE)
+    collapsed = ", style=" + _quote(cfg.PLOT_COLLAPSED_STYLE)
+
+    out.write("digraph {\n")
+    if graph_attrs:
+      out.write(f"graph [{self._format_attrs(graph_attrs)}];\n")
+    out.write(f"node [{self._format_attrs(self._shared_node_attrs())}];\n")
+    out.write(f"edge [{self._format_attrs(self._shared_edge_attrs())}];\n")
+
+    class_attrs = dict()
+    current_class = None
+    players = self.node_player[:self.num_nodes].tolist()
+    terminals = self.node_terminal[:self.num_nodes].tolist()
+    node_labels = self.node_label[:self.num_nodes].tolist()
+    flags = self.node_flags[:self.num_nodes].tolist()
+    for node in range(self.num_nodes):
+      node_class = (players[node], terminals[node])
+      if node_class != current_class:
+        attrs = class_attrs.get(node_class)
+        if attrs is None:
+          attrs = self._format_attrs(self._node_class_attrs(*node_class))
+          class_attrs[node_class] = attrs
+        out.write(f"node [{attrs}];\n")
+        current_class = node_class
+      label = _quote(labels[node_labels[node]])
+      out.write(f"{node} [label={label}")
+      if flags[node] & GameTree.HIGHLIGHT:
+        out.write(highlight)
+      if flags[node] & GameTree.TRUNCATED:
+        out.write(truncated)
+      if flags[node] & GameTree.COLLAPSED:
+        out.write(collapsed)
+      out.write("];\n")
+
+    class_attrs = dict()
+    current_class = None
+    srcs = self.edge_src[:self.num_edges].tolist()
+    dsts = self.edge_dst[:self.num_edges].tolist()
+    edge_labels = self.edge_label[:self.num_edges].tolist()
+    highlights = self.edge_highlight[:self.num_edges].tolist()
+    for edge in range(self.num_edges):
+      src = srcs[edge]
+      player = players[src]
+      if player != current_class:
+        attrs = class_attrs.get(player)
+        if attrs is None:
+          attrs = self._format_attrs(self._edge_class_attrs(player))
+          class_attrs[player] = attrs
+        out.write(f"edge [{attrs}];\n")
+        current_class = player
+      label = _quote(" " + labels[edge_labels[edge]])
+      out.write(f"{src} -> {dsts[edge]} "
+                f"[{edge_label}={label}")
+      if highlights[edge]:
+        out.write(highlight)
+      out.write("];\n")
+
+    self._write_infosets(out, players)
+    out.write("}\n")
+
+  def _write_infosets(self, out: TextIO, players: List[int]):
+    """Connect the nodes of each information set in a chain."""
+    infosets = self.node_infoset[:self.num_nodes].tolist()
+    last_member = dict()
+    attrs = ", ".join([
+        "dir=none", "constraint=false", "label=\"\"",
+        "style=" + _quote(cfg.PLOT_INFOSET_STYLE)])
+    for node, infoset in enumerate(infosets):
+      if not infoset:
+        continue
+      previous = last_member.get(infoset)
+      if previous is not None:
+        color = _quote(cfg.PLAYER_COLORS.get(players[node], "black"))
+        out.write(f"{previous} -> {node} [{attrs}, color={color}];\n")
+      last_member[infoset] = node
+
+  def to_string(self) -> str:
+    out = io.StringIO()
+    self.write_dot(out)
+    return out.getvalue()
@@ -1,9 +1,85 @@
+import collections
 import re
 import sys
-from typing import List
+import threading
+from typing import Dict, List, Optional, Tuple
 
 import pyspiel
 
+import spielviz.config as cfg
+
+# Store a snapshot of the replayed state every this many actions.
+_CHECKPOINT_INTERVAL = 16
+
+
+class StatePrefixCache:
+  """
+  LRU cache of state snapshots of a single game, keyed by their history.
+
+  Seeking to a history starts from the snapshot of its longest cached prefix,
+  so navigating within deep games does not replay the whole history again.
+  The snapshots are never handed out, only their clones. The cache is shared
+  by the UI and the thread that builds the graph, hold `lock` while using it.
+  """
+
+  def __init__(self, max_size: int):
+    assert max_size >= 0
+    self.max_size = max_size
+    self.game_str: Optional[str] = None
+    self.entries: Dict[Tuple[int, ...], pyspiel.State] = \
+      collections.OrderedDict()
+    # Number of entries of each history length. We look up only prefixes of
+    # these lengths.
+    self.lengths: Dict[int, int] = collections.Counter()
+    self.lock = threading.Lock()
+
+  def bind(self, game: pyspiel.Game):
+    """Use the cache for the given game, dropping entries of other games."""
+    game_str = str(game)
+    if game_str != self.game_str:
+      self.game_str = game_str
+      self.entries.clear()
+      self.lengths.clear()
+
+  def longest_prefix(self, history: List[int]) \
+      -> Tuple[int, Optional[pyspiel.State]]:
+    """
+    Find the snapshot of the longest cached prefix of the history.
+
+    :return: Length of the prefix and the snapshot (not a clone!),
+             or (0, None) if no prefix is cached.
+    """
+    for length in sorted(self.lengths, reverse=True):
+      if length > len(history):
+        continue
+      key = tuple(history[:length])
+      state = self.entries.get(key)
+      if state is not None:
+        self.entries.move_to_end(key)
+        return length, state
+    return 0, None
+
+  def put(self, state: pyspiel.State):
+    if self.max_size == 0:
+      return
+    key = tuple(state.history())
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      return
+    self.entries[key] = state.clone()
+    self.lengths[len(key)] += 1
+    while len(self.entries) > self.max_size:
+      evicted, _ = self.entries.popitem(last=False)
+      self.lengths[len(evicted)] -= 1
+      if not self.lengths[len(evicted)]:
+        del self.lengths[len(evicted)]
+
+  def __len__(self):
+    return len(self.entries)
+
+
+prefix_cache = StatePrefixCache(cfg.HISTORY_CACHE_SIZE)
+
 
 def state_from_history_str(game: pyspiel.Game,
     history_str: str) -> pyspiel.State:
@@ -18,17 +94,30 @@ def state_from_history_str(game: pyspiel.Game,
 
 def state_from_history(game: pyspiel.Game, history: List[int],
     move_limit: int = sys.maxsize) -> pyspiel.State:
-  rollout = game.new_initial_state()
-  num_players = game.num_players()
-  i = 0
-  while i < len(history) and rollout.move_number() < move_limit:
-    if rollout.is_simultaneous_node():
-      rollout.apply_actions(history[i:i + num_players])
-      i += num_players
-    else:
-      rollout.apply_action(history[i])
-      i += 1
-  return rollout
+  with prefix_cache.lock:
+    prefix_cache.bind(game)
+    i, snapshot = prefix_cache.longest_prefix(history)
+    # The replay must not go past the move limit.
+    while snapshot is not None \
+        and snapshot.move_number() > max(move_limit, 0):
+      i, snapshot = prefix_cache.longest_prefix(history[:i - 1])
+    rollout = game.new_initial_state() if snapshot is None \
+      else snapshot.clone()
+
+    num_players = game.num_players()
+    next_checkpoint = i + _CHECKPOINT_INTERVAL
+    while i < len(history) and rollout.move_number() < move_limit:
+      if rollout.is_simultaneous_node():
+        rollout.apply_actions(history[i:i + num_players])
+        i += num_players
+      else:
+        rollout.apply_action(history[i])
+        i += 1
+      if i >= next_checkpoint:
+        prefix_cache.put(rollout)
+        next_checkpoint = i + _CHECKPOINT_INTERVAL
+    prefix_cache.put(rollout)
+    return rollout
 
 
 def state_undo_n_moves(state: pyspiel.State, n: int) -> pyspiel.State:
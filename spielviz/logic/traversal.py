@@ -0,0 +1,149 @@
+import itertools
+import logging
+import random
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pyspiel
+
+# Number of moves we try to undo when probing whether a game supports undo.
+_UNDO_PROBE_MOVES = 8
+# Game string -> does it support undo?
+_undo_support: Dict[str, bool] = dict()
+
+
+def supports_undo(game: pyspiel.Game) -> bool:
+  """
+  Check whether states of the game can be walked in place with
+  `apply_action` / `undo_action`. Not all games override `UndoAction`.
+  """
+  game_str = str(game)
+  if game_str not in _undo_support:
+    _undo_support[game_str] = _probe_undo(game)
+    logging.debug(f"Game '{game_str}' supports undo: "
+                  f"{_undo_support[game_str]}")
+  return _undo_support[game_str]
+
+
+def _probe_undo(game: pyspiel.Game) -> bool:
+  state = game.new_initial_state()
+  for _ in range(_UNDO_PROBE_MOVES):
+    if state.is_terminal():
+      break
+    if state.is_simultaneous_node():
+      # Joint actions are never undone, see `children`.
+      state.apply_actions([state.legal_actions(p)[0]
+                           for p in range(state.num_players())])
+      continue
+
+    player = state.current_player()
+    action = state.legal_actions()[0]
+    state_str = str(state)
+    history = state.history()
+    state.apply_action(action)
+    try:
+      state.undo_action(player, action)
+    except (pyspiel.SpielError, RuntimeError):
+      return False
+    if str(state) != state_str or state.history() != history:
+      return False
+    state.apply_action(action)
+  return True
+
+
+def joint_actions(state: pyspiel.State,
+    limit: Optional[int] = None) -> List[List[int]]:
+  """
+  Actions that lead to the children of the state, in the usual order.
+
+  :param limit: Return at most this many. The joint actions of simultaneous
+                nodes are generated lazily, so that the whole product
+                of the players' actions is never enumerated.
+  """
+  if state.is_player_node() or state.is_chance_node():
+    return [[action] for action in state.legal_actions()[:limit]]
+  elif state.is_simultaneous_node():
+    player_actions = [state.legal_actions(p)
+                      for p in range(state.num_players())]
+    return [list(actions) for actions in
+            itertools.islice(itertools.product(*player_actions), limit)]
+  elif state.is_terminal():
+    return []
+  else:
+    raise RuntimeError(f"Unhandled type of state! {str(state)}")
+
+
+def is_legal(state: pyspiel.State, actions: List[int]) -> bool:
+  """Do the (joint) actions lead to a child of the state?"""
+  if state.is_simultaneous_node():
+    return len(actions) == state.num_players() and all(
+        action in state.legal_actions(p) for p, action in enumerate(actions))
+  return len(actions) == 1 and actions[0] in state.legal_actions()
+
+
+def random_actions(state: pyspiel.State, rng: random.Random) -> List[int]:
+  """
+  Uniformly random child of the state, as its (joint) actions. For
+  simultaneous nodes, each player's action is chosen independently.
+  """
+  if state.is_simultaneous_node():
+    return [rng.choice(state.legal_actions(p))
+            for p in range(state.num_players())]
+  return [rng.choice(state.legal_actions())]
+
+
+def max_shown_children(simultaneous: bool, top_k: int,
+    max_joint_actions: int) -> int:
+  """
+  Maximal number of children of a node that are shown before the rest is
+  collapsed, 0 if all the children are shown.
+  """
+  limits = [top_k, max_joint_actions if simultaneous else 0]
+  return min([limit for limit in limits if limit], default=0)
+
+
+def num_children(state: pyspiel.State) -> int:
+  if state.is_player_node() or state.is_chance_node():
+    return len(state.legal_actions())
+  elif state.is_simultaneous_node():
+    num = 1
+    for p in range(state.num_players()):
+      num *= len(state.legal_actions(p))
+    return num
+  else:
+    return 0
+
+
+def children(state: pyspiel.State, in_place: bool = False,
+    actions_list: Optional[List[List[int]]] = None) \
+    -> Iterator[Tuple[pyspiel.State, List[int]]]:
+  """
+  Generate the children of the state, with the actions leading to them.
+
+  If `in_place` is set, the child is the state itself, with the action
+  applied. It is valid only until the next child is generated, and the state
+  is restored once the generator finishes (or is closed). Copy the child with
+  `clone()` if you need to keep it.
+
+  Simultaneous nodes are always cloned, as joint actions can't be undone.
+
+  :param actions_list: Actions to apply, `joint_actions(state)` by default.
+  """
+  if actions_list is None:
+    actions_list = joint_actions(state)
+
+  if state.is_simultaneous_node():
+    for actions in actions_list:
+      child = state.clone()
+      child.apply_actions(actions)
+      yield child, actions
+  elif in_place:
+    player = state.current_player()
+    for actions in actions_list:
+      state.apply_action(actions[0])
+      try:
+        yield state, actions
+      finally:
+        state.undo_action(player, actions[0])
+  else:
+    for actions in actions_list:
+      yield state.child(actions[0]), actions
@@ -0,0 +1,116 @@
+import random
+from typing import List, Optional
+
+import pyspiel
+
+import spielviz.config as cfg
+from spielviz.logic import traversal
+from spielviz.logic.state_history import state_undo_n_moves
+
+
+def estimate_level_sizes(state: pyspiel.State, max_depth: Optional[int],
+    num_probes: int = cfg.TREE_ESTIMATE_PROBES,
+    limit: float = float("inf"),
+    top_k: int = cfg.TREE_TOP_K,
+    max_joint_actions: int = cfg.TREE_MAX_JOINT_ACTIONS,
+    rng: Optional[random.Random] = None) -> List[float]:
+  """
+  Estimate the number of nodes at each depth below the state, using Knuth's
+  random probing: follow random paths down the tree and multiply
+  the branching factors along them. The average of these products is an
+  unbiased estimate of the size of the level.
+
+  :param max_depth: Probe at most this many levels, None for no limit.
+  :param limit: Stop a probe once its level estimate exceeds the limit,
+                the levels below would not fit into any budget anyway.
+  :param top_k: Account for collapsing all but `top_k` children of a node
+                into a single node, see `GameTreeViz`.
+  :param max_joint_actions: The same as `top_k`, for simultaneous nodes.
+  :return: Estimated number of nodes at depths 0, 1, ... (the state itself
+           is at depth 0).
+  """
+  rng = rng or random.Random(0)
+  sums = [float(num_probes)]
+  for _ in range(num_probes):
+    probe = state.clone()
+    level_size = 1.
+    depth = 0
+    while max_depth is None or depth < max_depth:
+      # Joint actions are counted, not enumerated.
+      num_children = traversal.num_children(probe)
+      if not num_children:
+        break
+      simultaneous = probe.is_simultaneous_node()
+      max_shown = traversal.max_shown_children(simultaneous, top_k,
+                                               max_joint_actions)
+      if max_shown and num_children > max_shown + 1:
+        # The collapsed node is shown, but never expanded.
+        num_expanded = max_shown
+        num_children = max_shown + 1
+      else:
+        num_expanded = num_children
+      depth += 1
+      if depth == len(sums):
+        sums.append(0.)
+      sums[depth] += level_size * num_children
+      level_size *= num_expanded
+      if level_size > limit:
+        break
+      if num_expanded < num_children:
+        actions = rng.choice(traversal.joint_actions(probe, num_expanded))
+      else:
+        actions = traversal.random_actions(probe, rng)
+      if probe.is_simultaneous_node():
+        probe.apply_actions(actions)
+      else:
+        probe.apply_action(actions[0])
+  return [total / num_probes for total in sums]
+
+
+def estimate_num_nodes(state: pyspiel.State, full_tree: bool = False,
+    lookahead: int = 1, lookbehind: int = 1,
+    limit: float = float("inf"), top_k: int = cfg.TREE_TOP_K,
+    max_joint_actions: int = cfg.TREE_MAX_JOINT_ACTIONS) -> float:
+  """Estimate the number of nodes of the tree that `GameTreeViz` builds."""
+  if full_tree:
+    root = state.get_game().new_initial_state()
+    return sum(estimate_level_sizes(root, None, limit=limit, top_k=top_k,
+                                    max_joint_actions=max_joint_actions))
+  return (num_lookbehind_nodes(state, lookbehind, top_k, max_joint_actions)
+          + sum(estimate_level_sizes(state, lookahead, limit=limit,
+                                     top_k=top_k,
+                                     max_joint_actions=max_joint_actions)))
+
+
+def num_lookbehind_nodes(state: pyspiel.State, lookbehind: int,
+    top_k: int = cfg.TREE_TOP_K,
+    max_joint_actions: int = cfg.TREE_MAX_JOINT_ACTIONS) -> int:
+  """
+  Number of nodes above the state: the trajectory to the state and
+  the siblings along it. These can be counted exactly.
+  """
+  if not lookbehind:
+    return 0
+  rollout = state_undo_n_moves(state, lookbehind)
+  history = state.history()
+  num_players = rollout.num_players()
+  # The root and the children along the trajectory, except for the current
+  # state, which is counted by the lookahead.
+  num_nodes = 0
+  i = len(rollout.history())
+  while i < len(history):
+    num_children = traversal.num_children(rollout)
+    max_shown = traversal.max_shown_children(
+        rollout.is_simultaneous_node(), top_k, max_joint_actions)
+    if max_shown and num_children > max_shown + 1:
+      # The shown children, the child on the trajectory and the collapsed
+      # node.
+      num_children = max_shown + 2
+    num_nodes += num_children
+    if rollout.is_simultaneous_node():
+      rollout.apply_actions(history[i:i + num_players])
+      i += num_players
+    else:
+      rollout.apply_action(history[i])
+      i += 1
+  return num_nodes
@@ -0,0 +1,75 @@
+"""
+Pool of worker processes shared by the tree expansion and the layout.
+"""
+
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Tuple
+
+_executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+# Number of worker processes of the executor.
+_executor_workers = 0
+# How often to check whether the work was cancelled while waiting for
+# the workers, in seconds.
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+def get_executor(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+  """The pool with this many workers, created on first use."""
+  global _executor, _executor_workers
+  if _executor is None or _executor_workers != workers:
+    if _executor is not None:
+      _executor.shutdown(wait=False)
+    # Forking a process with running GTK main loop is not safe.
+    _executor = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn"))
+    _executor_workers = workers
+  return _executor
+
+
+def discard_executor(executor: concurrent.futures.ProcessPoolExecutor):
+  """
+  Drop the pool once it raised `BrokenProcessPool`: a worker that dies,
+  for example killed when out of memory, breaks the pool for good.
+  The next `get_executor` creates a new one.
+  """
+  global _executor
+  if executor is _executor:
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def submit_all(workers: int, fn: Callable, calls: List[Tuple]) \
+    -> Tuple[concurrent.futures.ProcessPoolExecutor,
+             List[concurrent.futures.Future]]:
+  """
+  Run the function with each of the arguments in the pool, replacing
+  the pool first if it is broken.
+
+  :return: The pool, to be discarded if the futures raise
+           `BrokenProcessPool`, and the futures.
+  """
+  executor = get_executor(workers)
+  try:
+    return executor, [executor.submit(fn, *args) for args in calls]
+  except BrokenProcessPool:
+    discard_executor(executor)
+  executor = get_executor(workers)
+  return executor, [executor.submit(fn, *args) for args in calls]
+
+
+def result(future: concurrent.futures.Future,
+    cancelled: Optional[Callable[[], bool]] = None):
+  """
+  Wait for the result of the future. Raise `CancelledError` once
+  `cancelled` returns True.
+  """
+  if cancelled is None:
+    return future.result()
+  while True:
+    try:
+      return future.result(CANCEL_CHECK_INTERVAL)
+    except concurrent.futures.TimeoutError:
+      if cancelled():
+        raise concurrent.futures.CancelledError()
@@ -1,18 +1,26 @@
+import concurrent.futures
 import logging
 import math
+import subprocess
 import time
-from typing import Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import cairo
 import pyspiel
 from gi.overrides.Gdk import EventButton, EventMotion
-from gi.repository import GObject, Gdk, Gtk
+from gi.repository import GLib, GObject, Gdk, Gtk
 from gi.repository.Gdk import Rectangle
 
 import spielviz.config as cfg
 import spielviz.graphics.elements as elements
-from spielviz.dot.parser import make_graph, make_xdotcode
-from spielviz.logic.dotcode_tree import GameTreeViz
+from spielviz.dot.layout_cache import LayoutCache
+from spielviz.dot.lexer import ParseError
+from spielviz.dot.parser import layout_graph
+from spielviz.graphics.tree_layout import TreeLayout, split_layout
+from spielviz.logic.dotcode_tree import COLLAPSED_SUFFIX, GameTreeViz
+from spielviz.logic.expansion_cache import ExpansionCache
+from spielviz.logic.tree_size import estimate_level_sizes, \
+  estimate_num_nodes, num_lookbehind_nodes
 from spielviz.ui import actions, animation, spielviz_events, press_state
 
 
@@ -58,21 +66,196 @@ class PlotArea(GObject.GObject):
     self.drag_action = actions.NullAction(self)
     # Differentiate between clicking and dragging in the plot area.
     self.press_state = press_state.PressState()
+    # Expanded nodes of the game tree, reused between updates.
+    self.expansion_cache = ExpansionCache(cfg.TREE_CACHE_SIZE)
+    # Layouts of the graphs, reused when the same graph is drawn again.
+    self.layout_cache = LayoutCache(cfg.LAYOUT_CACHE_DIR,
+                                    cfg.LAYOUT_CACHE_MAX_BYTES,
+                                    cfg.LAYOUT_CACHE_MEMORY_ENTRIES)
+    # Tidy tree layout, which reuses the previous one.
+    self.tree_layout = TreeLayout()
+    # Keys of nodes whose collapsed children were expanded by clicking,
+    # and the game they belong to.
+    self.expanded: Set[str] = set()
+    self.expanded_game: Optional[str] = None
+    # Keys (history strings) of the drawn nodes, by their id in the graph.
+    self.node_keys: List[str] = []
+    # Arguments of the last update, to redraw the tree with more nodes.
+    self.last_update: Optional[Tuple[pyspiel.State, Dict]] = None
+    # Game for which the user agreed to show a truncated full tree.
+    self.confirmed_full_tree: Optional[str] = None
+    # The graph is built and laid out in a background thread, so that
+    # the current graph stays interactive. One update runs at a time,
+    # as they share the expansion cache.
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    # Generation of the latest update. Results of the older ones are stale.
+    self.generation = 0
+
+  def update(self, state: pyspiel.State, fit: bool = True, **kwargs):
+    """
+    Start building the graph of the state in the background. It replaces
+    the current graph once it is ready, unless a newer update was started.
 
-
-  def update(self, state: pyspiel.State, **kwargs):
-    gametree = GameTreeViz(state=state, **kwargs)
-    count = 0
-    for _ in gametree.build_tree():
-      if count >= cfg.TREE_MAX_NODES:
+    :param fit: Zoom to fit the new graph.
+    """
+    game_str = str(state.get_game())
+    if game_str != self.expanded_game:
+      self.expanded_game = game_str
+      self.expanded.clear()
+    self.last_update = (state, kwargs)
+    self.generation += 1
+    self.executor.submit(self._build_graph, self.generation, state,
+                         set(self.expanded), fit, kwargs,
+                         game_str == self.confirmed_full_tree)
+
+  def _build_graph(self, generation: int, state: pyspiel.State,
+      expanded: Set[str], fit: bool, kwargs: Dict, confirmed: bool):
+    """Runs in the background thread."""
+    def cancelled() -> bool:
+      # A newer update, or closing the window, makes this one obsolete.
+      return generation != self.generation
+
+    if cancelled():
+      return
+    try:
+      kwargs = self._fit_into_budget(generation, state, kwargs, confirmed)
+      if kwargs is None:
+        return
+      gametree = GameTreeViz(state=state, max_nodes=cfg.TREE_MAX_NODES,
+                             cache=self.expansion_cache,
+                             expanded=expanded, **kwargs)
+      gametree.build_tree(cancelled)
+      if gametree.truncated:
         logging.warning("There are too many nodes in the tree. "
-                        f"Showing only {count} of them.")
-        break
-      count += 1
+                        f"Showing only {gametree.num_nodes} of them.")
+
+      if cancelled():
+        return
+      if cfg.LAYOUT == "tidy":
+        graph = self.tree_layout.layout(gametree.tree)
+      elif gametree.num_nodes >= cfg.LAYOUT_SPLIT_MIN_NODES:
+        graph = split_layout(gametree.tree, cancelled=cancelled)
+        if graph is None:
+          graph = self._layout_with_graphviz(gametree, cancelled)
+        elif graph.fast_layout:
+          logging.warning("Laying out parts of the tree took too long, "
+                          "showing them with a fast layout instead.")
+      else:
+        graph = self._layout_with_graphviz(gametree, cancelled)
+    except concurrent.futures.CancelledError:
+      return
+    except (pyspiel.SpielError, RuntimeError, OSError, ParseError) as e:
+      GLib.idle_add(self._update_failed, generation, e)
+      return
+    except Exception as e:
+      # Nothing waits for the result of the background thread, so report
+      # unexpected errors here instead of losing them.
+      logging.exception("Could not draw the game tree.")
+      GLib.idle_add(self._update_failed, generation, e)
+      return
+    GLib.idle_add(self._finish_update, generation, graph,
+                  gametree.tree.keys, fit)
+
+  def _fit_into_budget(self, generation: int, state: pyspiel.State,
+      kwargs: Dict, confirmed: bool) -> Optional[Dict]:
+    """
+    Estimate the size of the tree before it is built, runs in the background
+    thread. The user is asked whether to show a full tree that does not fit
+    into the node budget, and a lookahead that does not fit is reduced
+    for this update only.
+
+    :param confirmed: The user agreed to show a truncated full tree.
+    :return: Arguments of the tree to build, or None if the user is asked
+             first.
+    """
+    budget = cfg.TREE_MAX_NODES
+    # Probes can stop early, we only need to know if the tree is too large.
+    limit = 10 * budget
+    if kwargs.get("full_tree"):
+      if not confirmed:
+        num_nodes = estimate_num_nodes(state, full_tree=True, limit=limit)
+        if num_nodes > budget:
+          GLib.idle_add(self._confirm_full_tree, generation, state, num_nodes)
+          return None
+      return kwargs
+
+    max_lookahead = kwargs.get("lookahead", 1)
+    level_sizes = estimate_level_sizes(state, max_lookahead, limit=limit)
+    num_above = num_lookbehind_nodes(state, kwargs.get("lookbehind", 1))
+    lookahead = max_lookahead
+    while lookahead > 1 \
+        and num_above + sum(level_sizes[:lookahead + 1]) > budget:
+      lookahead -= 1
+    if lookahead < max_lookahead:
+      logging.warning(
+          f"The tree with lookahead {max_lookahead} would have about "
+          f"{num_above + sum(level_sizes):,.0f} nodes, "
+          f"reducing lookahead to {lookahead}.")
+      kwargs = dict(kwargs, lookahead=lookahead)
+    return kwargs
+
+  def _confirm_full_tree(self, generation: int, state: pyspiel.State,
+      num_nodes: float) -> bool:
+    if generation == self.generation:
+      if self.window.confirm_full_tree(num_nodes):
+        self.confirmed_full_tree = str(state.get_game())
+      self.window.update_plot_area(state)
+    # Run only once.
+    return False
 
+  def _layout_with_graphviz(self, gametree: GameTreeViz,
+      cancelled: Callable[[], bool]) -> elements.Graph:
+    """Runs in the background thread."""
     dotcode = gametree.to_string().encode()
-    xdotcode = make_xdotcode(dotcode)
-    self.graph = make_graph(xdotcode)
+    try:
+      return layout_graph(dotcode, cache=self.layout_cache,
+                          timeout=cfg.LAYOUT_TIMEOUT or None,
+                          cancelled=cancelled)
+    except subprocess.TimeoutExpired:
+      logging.warning(f"Laying out the tree took over {cfg.LAYOUT_TIMEOUT} s, "
+                      f"showing a fast layout instead.")
+      graph = self.tree_layout.layout(gametree.tree)
+      graph.fast_layout = True
+      return graph
+
+  def _finish_update(self, generation: int, graph: elements.Graph,
+      node_keys: List[str], fit: bool) -> bool:
+    if generation == self.generation:
+      if not fit:
+        self._keep_in_place(graph, node_keys)
+      self.graph = graph
+      self.node_keys = node_keys
+      if fit:
+        self.zoom_to_fit()
+      self.area.queue_draw()
+    # Run only once.
+    return False
+
+  def _keep_in_place(self, graph: elements.Graph, node_keys: List[str]):
+    """
+    Move the view along with the new graph, so that the shown node closest
+    to the center of the view stays where it is, whatever layout was used.
+    """
+    new_nodes = {node_keys[int(node.id)]: node for node in graph.nodes}
+    anchor, distance = None, math.inf
+    for node in self.graph.nodes:
+      d = math.hypot(node.x - self.graph_x, node.y - self.graph_y)
+      if d < distance and self.node_keys[int(node.id)] in new_nodes:
+        anchor, distance = node, d
+    if anchor is not None:
+      moved = new_nodes[self.node_keys[int(anchor.id)]]
+      self.graph_x += moved.x - anchor.x
+      self.graph_y += moved.y - anchor.y
+
+  def _update_failed(self, generation: int, error: Exception) -> bool:
+    if generation == self.generation:
+      self.window.error_dialog(f"Could not draw the game tree: {error}")
+    return False
+
+  def shutdown(self):
+    """Stop the background updates, when the window is closed."""
+    self.generation += 1
+    self.executor.shutdown(wait=False, cancel_futures=True)
 
   def show_all(self):
     self.zoom_to_fit()
@@ -92,7 +275,8 @@ class PlotArea(GObject.GObject):
     cr.translate(cx, cy)
     cr.scale(ratio, ratio)
     cr.translate(-x, -y)
-    self.graph.draw(cr, highlight_items=self.highlight, bounding=bounding)
+    self.graph.draw(cr, highlight_items=self.highlight, bounding=bounding,
+                    min_size=cfg.PLOT_MIN_SIZE / ratio)
 
   def on_draw(self, widget, cr: cairo.Context) -> bool:
     rect = self.area.get_allocation()
@@ -218,7 +402,7 @@ class PlotArea(GObject.GObject):
       win.set_focus(textentry[0])
       return True
     if event.keyval == Gdk.KEY_q:
-      Gtk.main_quit()
+      self.window.quit()
       return True
     return False
 
@@ -240,10 +424,20 @@ class PlotArea(GObject.GObject):
     click events. Note that element can be None
     (click on empty space)."""
     if isinstance(element, elements.Node):
-      history_str = element.id.decode().strip()
+      key = self.node_keys[int(element.id)]
+      if GameTreeViz.is_collapsed_key(key):
+        self.expand_collapsed(key[:-len(COLLAPSED_SUFFIX)])
+        return True
+      history_str = key.strip()
       self.emit(spielviz_events.CHANGE_HISTORY, history_str)
     return False
 
+  def expand_collapsed(self, key: str):
+    """Show all the children of the node, redrawing the tree."""
+    self.expanded.add(key)
+    state, kwargs = self.last_update
+    self.update(state, fit=False, **kwargs)
+
   def on_area_button_release(self, area, event: EventButton) -> bool:
     self.drag_action.on_button_release(event)
     self.drag_action = actions.NullAction(self)
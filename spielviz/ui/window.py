@@ -74,7 +74,7 @@ class MainWindow:
     self.game = None
 
     self.window = builder.get_object("window")
-    self.window.connect('delete-event', Gtk.main_quit)
+    self.window.connect('delete-event', lambda *args: self.quit())
     self.window.set_position(Gtk.WindowPosition.CENTER_ALWAYS)
     self.window.set_icon_from_file(ICON_FILE)
 
@@ -143,9 +143,20 @@ class MainWindow:
 
     self.show_full_tree = cfg.FULL_TREE
     self.full_tree = builder.get_object("full_tree")
-    self.full_tree.connect("toggled", self.toggle_full_tree)
+    self.full_tree_handler = self.full_tree.connect(
+        "toggled", self.toggle_full_tree)
     self.full_tree.set_active(self.show_full_tree)
 
+    self.merge_transpositions = cfg.TREE_TRANSPOSITIONS
+    self.transpositions = builder.get_object("transpositions")
+    self.transpositions.set_active(self.merge_transpositions)
+    self.transpositions.connect("toggled", self.toggle_transpositions)
+
+    self.show_infosets = cfg.TREE_INFOSETS
+    self.infosets = builder.get_object("infosets")
+    self.infosets.set_active(self.show_infosets)
+    self.infosets.connect("toggled", self.toggle_infosets)
+
     # Apply styles.
     css_provider = Gtk.CssProvider()
     css_provider.load_from_path(css_file)
@@ -165,6 +176,9 @@ class MainWindow:
     else:
       self.observing_player = observing_player - 1
     self.update_observer()
+    # Information sets are shown for the observing player.
+    if self.show_infosets and self.state is not None:
+      self.update_plot_area(self.state)
 
   def toggle_public_info(self, button: Gtk.CheckButton):
     do_show = button.get_active()
@@ -188,15 +202,20 @@ class MainWindow:
     self.update_observer()
 
   def toggle_full_tree(self, button: Gtk.CheckButton):
-    do_show = button.get_active()
-    if do_show:
-      self.show_full_tree = True
-      self.lookbehind_spinner.set_sensitive(False)
-      self.lookahead_spinner.set_sensitive(False)
-    else:
-      self.show_full_tree = False
-      self.lookbehind_spinner.set_sensitive(True)
-      self.lookahead_spinner.set_sensitive(True)
+    self.set_full_tree(button.get_active())
+    self.update_plot_area(self.state)
+
+  def set_full_tree(self, do_show: bool):
+    self.show_full_tree = do_show
+    self.lookbehind_spinner.set_sensitive(not do_show)
+    self.lookahead_spinner.set_sensitive(not do_show)
+
+  def toggle_transpositions(self, button: Gtk.CheckButton):
+    self.merge_transpositions = button.get_active()
+    self.update_plot_area(self.state)
+
+  def toggle_infosets(self, button: Gtk.CheckButton):
+    self.show_infosets = button.get_active()
     self.update_plot_area(self.state)
 
   def update_lookahead(self, button: Gtk.SpinButton):
@@ -278,8 +297,29 @@ class MainWindow:
   def update_plot_area(self, state: pyspiel.State):
     self.plot_area.update(state, full_tree=self.show_full_tree,
                           lookbehind=self.lookbehind,
-                          lookahead=self.lookahead)
-    self.plot_area.show_all()
+                          lookahead=self.lookahead,
+                          transpositions=self.merge_transpositions,
+                          infosets=self.show_infosets,
+                          infoset_player=self.observing_player)
+
+  def confirm_full_tree(self, num_nodes: float) -> bool:
+    """
+    Ask whether to show a full tree that does not fit into the node budget,
+    truncated. If not, the full tree is turned off.
+    """
+    budget = cfg.TREE_MAX_NODES
+    if self.warning_dialog(
+        f"The full tree has about {num_nodes:,.0f} nodes, only {budget} "
+        f"of them will be shown. Show the full tree anyway?"):
+      return True
+    with self.full_tree.handler_block(self.full_tree_handler):
+      self.full_tree.set_active(False)
+    self.set_full_tree(False)
+    return False
+
+  def quit(self):
+    self.plot_area.shutdown()
+    Gtk.main_quit()
 
   def on_reload(self, action):
     self.plot_area.reload()